@@ -0,0 +1,64 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+
+# Compares the heap-based lane assignment used by the timeline with a first-fit scan over all rows on synthetic traces
+
+__author__ = 'Sayed Hadi Hashemi'
+
+import time
+
+import numpy as np
+from tftracer.event_table import assign_rows
+
+NUM_EVENTS = [10000, 50000, 200000]
+CONCURRENCY = [4, 64, 512]
+SEED = 0
+
+
+def first_fit_rows(start, end):
+    rows = []
+    event_rows = np.zeros(len(start), dtype=np.int32)
+    for i in np.argsort(start, kind="stable"):
+        for j, row in enumerate(rows):
+            if row <= start[i]:
+                event_rows[i] = j
+                rows[j] = end[i]
+                break
+        else:
+            event_rows[i] = len(rows)
+            rows.append(end[i])
+    return event_rows, len(rows)
+
+
+def synthetic_trace(num_events, concurrency, rand):
+    # About `concurrency` events are in flight at any time.
+    duration = rand.exponential(1.0, size=num_events) + 0.001
+    start = rand.uniform(0, num_events * duration.mean() / concurrency, size=num_events)
+    return start, start + duration
+
+
+def timed(func, *args):
+    tick = time.time()
+    result = func(*args)
+    return result, time.time() - tick
+
+
+def main():
+    rand = np.random.RandomState(SEED)
+    print("{:>10} {:>12} {:>8} {:>12} {:>12}".format("events", "concurrency", "rows", "first-fit", "heap"))
+    for num_events in NUM_EVENTS:
+        for concurrency in CONCURRENCY:
+            start, end = synthetic_trace(num_events, concurrency, rand)
+            (heap_rows, n_rows), heap_time = timed(assign_rows, start, end)
+            if num_events * n_rows <= 10 ** 9:
+                (scan_rows, scan_n_rows), scan_time = timed(first_fit_rows, start, end)
+                assert scan_n_rows == n_rows and np.array_equal(scan_rows, heap_rows), "layouts differ"
+                scan_time = "{:.3f}s".format(scan_time)
+            else:
+                scan_time = "skipped"
+            print("{:>10} {:>12} {:>8} {:>12} {:>11.3f}s".format(num_events, concurrency, n_rows, scan_time,
+                                                                 heap_time))
+
+
+if __name__ == '__main__':
+    main()
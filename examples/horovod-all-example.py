@@ -54,7 +54,7 @@ def main(_):
             sess.run(train_op)
 
     # Save the tracing session
-    tracing_server.save_session("session-{}.pickle".format(hvd.rank()))
+    tracing_server.save_session("session-{}.tftrace".format(hvd.rank()))
 
     # Keep the tracing server running beyond training. Remove otherwise.
     tracing_server.join()
@@ -0,0 +1,77 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+
+# Collecting the traces of all horovod processes into one tracing server.
+# Run with: horovodrun -np 4 -H localhost:4 python horovod-collector-example.py
+
+__author__ = 'Sayed Hadi Hashemi'
+
+import tensorflow as tf
+import horovod.tensorflow as hvd
+from tensorflow.contrib.slim.nets import inception
+from tftracer import TracingServer, CollectorClient, EveryNStepsPolicy
+
+INPUT_SIZE = [299, 299, 3]
+MINIBATCH_SIZE = 4
+NUM_CLASSES = 1000
+NUM_STEPS = 200
+
+# Address of the tracing server, which runs on rank 0
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 9999
+
+
+def get_model():
+    input_data = tf.random_uniform([MINIBATCH_SIZE] + INPUT_SIZE)
+    labels = tf.random_uniform([MINIBATCH_SIZE, NUM_CLASSES])
+    logit, _ = inception.inception_v3(input_data, num_classes=NUM_CLASSES)
+    loss = tf.losses.softmax_cross_entropy(labels, logit)
+    train_op = hvd.DistributedOptimizer(tf.train.MomentumOptimizer(0.01, 0.01)).minimize(loss)
+    return train_op
+
+
+def get_config():
+    config = tf.ConfigProto()
+    config.gpu_options.allow_growth = True
+    config.gpu_options.visible_device_list = str(hvd.local_rank())
+
+    if hvd.rank() == 0:
+        tf.logging.set_verbosity(tf.logging.INFO)
+    else:
+        tf.logging.set_verbosity(tf.logging.WARN)
+
+    return dict(config=config)
+
+
+def main(_):
+    hvd.init()
+    train_op = get_model()
+
+    hooks = [
+        hvd.BroadcastGlobalVariablesHook(0),
+    ]
+
+    if hvd.rank() == 0:
+        tracing_server = TracingServer(server_port=SERVER_PORT)
+
+    # Every process, including rank 0, traces the same steps and sends them to the tracing server
+    collector = CollectorClient("http://{}:{}".format(SERVER_HOST, SERVER_PORT), rank=hvd.rank(),
+                                tracing_policy=EveryNStepsPolicy(50, offset=10))
+    hooks.append(collector.hook)
+
+    with tf.train.MonitoredTrainingSession(hooks=hooks, **get_config()) as sess:
+        for _ in range(NUM_STEPS):
+            sess.run(train_op)
+
+    collector.close()
+
+    if hvd.rank() == 0:
+        # Save the tracing session
+        tracing_server.save_session("session.tftrace")
+
+        # Keep the tracing server running beyond training. Remove otherwise.
+        tracing_server.join()
+
+
+if __name__ == "__main__":
+    tf.app.run()
@@ -55,7 +55,7 @@ def main(_):
 
     if hvd.rank() == 0:
         # Save the tracing session
-        tracing_server.save_session("session.pickle")
+        tracing_server.save_session("session.tftrace")
 
         # Keep the tracing server running beyond training. Remove otherwise.
         tracing_server.join()
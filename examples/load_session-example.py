@@ -7,7 +7,7 @@ from tftracer import TracingServer
 __author__ = 'Sayed Hadi Hashemi'
 if __name__ == '__main__':
     server = TracingServer()
-    server.load_session("session.pickle")
+    server.load_session("session.tftrace")
 
     # TODO(xldrx): Slow Server Workaround
     time.sleep(5)
@@ -31,7 +31,7 @@ def main():
             sess.run(train_op)
 
     # Save the tracing session
-    tracing_server.save_session("session.pickle")
+    tracing_server.save_session("session.tftrace")
 
     # Keep the tracing server running beyond training. Remove otherwise.
     tracing_server.join()
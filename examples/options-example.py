@@ -48,7 +48,7 @@ def main():
     estimator.evaluate(input_fn, hooks=[tracing_server.hook])
 
     # Save the tracing session
-    tracing_server.save_session("session.pickle")
+    tracing_server.save_session("session.tftrace")
 
     # Keep the tracing server running beyond training. Remove otherwise.
     tracing_server.join()
@@ -0,0 +1,61 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import unittest
+
+import numpy as np
+
+from tftracer.event_table import EventTable, StringColumn
+from tftracer.lod import LanePyramid
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+def _lane(start_micros, duration_micros):
+    n = len(start_micros)
+    return EventTable(
+        start_micros=np.asarray(start_micros, dtype=np.int64),
+        end_rel_micros=np.asarray(duration_micros, dtype=np.int64),
+        device=np.zeros(n, dtype=np.int32),
+        devices=["/device:GPU:0"],
+        name=StringColumn.encode(["op{}".format(i) for i in range(n)]),
+        description=StringColumn.encode(["kernel"] * n),
+        is_comm=np.zeros(n, dtype=np.bool_),
+        node_index=np.arange(n),
+    )
+
+
+class LanePyramidTest(unittest.TestCase):
+    def test_back_to_back_ops_come_apart_when_zoomed_in(self):
+        # 200000 back-to-back 10 us kernels on one stream.
+        n = 200000
+        pyramid = LanePyramid(_lane(np.arange(n) * 10, np.full(n, 10)))
+
+        self.assertGreater(len(pyramid.levels), 0)
+        self.assertLessEqual(len(pyramid.levels), 10)
+        zoomed_out = pyramid.query(0, 2000, 2000 / 1200)
+        self.assertLess(len(zoomed_out["start"]), 3000)
+        self.assertEqual(zoomed_out["count"].sum(), n)
+
+        # Under 0.1 ms at 0.1 us per pixel: the first 10 individual kernels.
+        zoomed_in = pyramid.query(0, 0.095, 0.0001)
+        self.assertEqual(zoomed_in["count"].tolist(), [1] * 10)
+        self.assertEqual(zoomed_in["index"].tolist(), list(range(10)))
+
+    def test_wide_ops_are_not_merged(self):
+        # Wide ops among many narrow ones stay individual at every level.
+        starts = np.arange(10000) * 10
+        durations = np.full(10000, 1)
+        durations[::1000] = 9
+        pyramid = LanePyramid(_lane(starts, durations))
+        for resolution, level in pyramid.levels:
+            merged = level["count"] > 1
+            self.assertTrue(np.all(level["end"][merged] - level["start"][merged] < 2 * resolution + 0.01))
+
+    def test_no_level_finer_than_a_microsecond(self):
+        pyramid = LanePyramid(_lane(np.arange(1000), np.zeros(1000)))
+        for resolution, _ in pyramid.levels:
+            self.assertGreater(resolution, 0.001)
+
+
+if __name__ == '__main__':
+    unittest.main()
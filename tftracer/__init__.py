@@ -5,5 +5,7 @@ __author__ = 'Sayed Hadi Hashemi'
 
 from .timeline import Timeline
 from .tracing_server import TracingServer
+from .collector import CollectorClient
 from .monkey_patching import hook_inject
+from .tracing_policy import TracingPolicy, EveryNStepsPolicy, ProbabilisticPolicy, WarmupPolicy, AdaptivePolicy
 from .version import __version__
\ No newline at end of file
@@ -5,9 +5,12 @@ __author__ = 'Sayed Hadi Hashemi'
 import argparse
 import errno
 import os
+import sys
 import time
 import traceback
 from . import TracingServer
+from .analysis import analyze as analyze_traces
+from .export import export_session
 
 FLAGS = None
 
@@ -34,26 +37,190 @@ def arg_parser():
     )
     FLAGS, _ = parser.parse_known_args()
 
-def main():
 
-    arg_parser()
+def convert_arg_parser(args):
+    global FLAGS
+    parser = argparse.ArgumentParser("tftracer convert",
+                                     description="Converts a pickled tracing session to a session file")
+    parser.add_argument(
+        "pickle_file",
+        type=str,
+        help="Path to the pickled trace session (.pickle or .pickle.gz)"
+    )
+    parser.add_argument(
+        "session_file",
+        type=str,
+        help="Path to the output session file"
+    )
+    FLAGS = parser.parse_args(args)
 
-    filename = FLAGS.session_file
+
+def analyze_arg_parser(args):
+    global FLAGS
+    parser = argparse.ArgumentParser("tftracer analyze",
+                                     description="Computes the timeline metrics of every trace in the inputs")
+    parser.add_argument(
+        "inputs",
+        type=str,
+        nargs="+",
+        help="Session files, pickled sessions, Timeline.to_pickle files or directories of them"
+    )
+    parser.add_argument(
+        "--output", "-o",
+        type=str,
+        help="Path to the output file, '-' for the standard output",
+        default="-"
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        choices=["csv", "json"],
+        help="Output format; json writes one object per line",
+        default="csv"
+    )
+    parser.add_argument(
+        "--jobs", "-j",
+        type=int,
+        help="Number of worker processes (default: number of CPUs)",
+        default=None
+    )
+    parser.add_argument(
+        "--device-pattern",
+        type=str,
+        help="Only include devices whose name contains this pattern",
+        default=None
+    )
+    parser.add_argument(
+        "--exclude-pattern",
+        type=str,
+        help="Exclude ops whose description contains this pattern",
+        default=None
+    )
+    parser.add_argument(
+        "--max-tasks-per-child",
+        type=int,
+        help="Replace a worker process after this many traces, to bound its memory",
+        default=100
+    )
+    FLAGS = parser.parse_args(args)
+
+
+def export_arg_parser(args):
+    global FLAGS
+    parser = argparse.ArgumentParser("tftracer export",
+                                     description="Exports every trace of a tracing session to static HTML pages")
+    parser.add_argument(
+        "session_file",
+        type=str,
+        help="Path to the trace session file"
+    )
+    parser.add_argument(
+        "out_dir",
+        type=str,
+        help="Path to the output directory"
+    )
+    parser.add_argument(
+        "--jobs", "-j",
+        type=int,
+        help="Number of worker processes (default: number of CPUs)",
+        default=None
+    )
+    parser.add_argument(
+        "--device-pattern",
+        type=str,
+        help="A regex pattern used to choose which device to be included",
+        default=None
+    )
+    parser.add_argument(
+        "--embed-details",
+        action="store_true",
+        help="Embed the details of every op, shown when an op is clicked"
+    )
+    parser.add_argument(
+        "--single-canvas",
+        action="store_true",
+        help="Draw all devices of a trace into one figure"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Render every trace, even if unchanged since the last export"
+    )
+    FLAGS = parser.parse_args(args)
+
+
+def check_exists(filename):
     if not os.path.exists(filename):
         print("File not found: {}".format(filename))
         exit(errno.ENOENT)
+
+
+def convert():
+    convert_arg_parser(sys.argv[2:])
+    check_exists(FLAGS.pickle_file)
+    server = TracingServer(start_web_server_on_start=False)
+    server.load_session(FLAGS.pickle_file)
+    server.save_session(FLAGS.session_file)
+
+
+def analyze():
+    analyze_arg_parser(sys.argv[2:])
+    for filename in FLAGS.inputs:
+        check_exists(filename)
+    fp = sys.stdout if FLAGS.output == "-" else open(FLAGS.output, "w", newline="")
+    try:
+        errors = analyze_traces(FLAGS.inputs, fp, output_format=FLAGS.format, jobs=FLAGS.jobs,
+                                device_pattern=FLAGS.device_pattern, exclude_pattern=FLAGS.exclude_pattern,
+                                max_tasks_per_child=FLAGS.max_tasks_per_child)
+    finally:
+        if fp is not sys.stdout:
+            fp.close()
+    if errors:
+        print("Failed to analyze {} traces".format(errors), file=sys.stderr)
+        exit(1)
+
+
+def export():
+    export_arg_parser(sys.argv[2:])
+    check_exists(FLAGS.session_file)
+    counts = export_session(FLAGS.session_file, FLAGS.out_dir, jobs=FLAGS.jobs, device_pattern=FLAGS.device_pattern,
+                            embed_details=FLAGS.embed_details, single_canvas=FLAGS.single_canvas, force=FLAGS.force,
+                            log=print)
+    print("{rendered} rendered, {skipped} unchanged, {failed} failed".format(**counts))
+    if counts["failed"]:
+        exit(1)
+
+
+def serve():
+    arg_parser()
+
+    filename = FLAGS.session_file
+    check_exists(filename)
+    server = TracingServer(server_port=FLAGS.port, server_ip=FLAGS.ip)
+    try:
+        server.load_session(filename)
+        # todo(xldrx): workaround
+        time.sleep(5)
+        server.join()
+    except Exception as ex:
+        traceback.print_exc()
+        print(ex)
+        server.stop_web_server()
+        exit()
+
+
+COMMANDS = {
+    "convert": convert,
+    "analyze": analyze,
+    "export": export,
+}
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]]()
     else:
-        server = TracingServer(server_port=FLAGS.port, server_ip=FLAGS.ip)
-        try:
-            server.load_session(filename)
-            # todo(xldrx): workaround
-            time.sleep(5)
-            server.join()
-        except Exception as ex:
-            traceback.print_exc()
-            print(ex)
-            server.stop_web_server()
-            exit()
+        serve()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,154 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+"""
+Batch analysis of traces: computes the :class:`tftracer.Timeline` metrics of every trace in a set of session files,
+pickled sessions and ``Timeline.to_pickle`` files, in parallel.
+"""
+import csv
+import gzip
+import json
+import multiprocessing
+import os
+import pickle
+
+from .session_file import SessionFile, is_session_file
+from .timeline import Timeline
+
+__author__ = 'Sayed Hadi Hashemi'
+
+FIELDS = ("file", "run_id", "trace_id", "step_time", "computation_time", "communication_time",
+          "communication_elapsed_time", "communication_overlap_time", "communication_exposed_time", "error")
+EXTENSIONS = (".tftrace", ".pickle", ".pkl", ".pickle.gz", ".pkl.gz")
+
+# The last session file opened by this worker; consecutive tasks usually read the same file.
+_session_file = None
+
+
+def find_traces(paths):
+    """
+    Walks the inputs. Directories are searched recursively for files with one of ``EXTENSIONS``.
+
+    Yields:
+        tuple: (path, key) where key is the ``(run_id, trace_id)`` of a trace in a session file, or None for other
+        files, whose traces are only known once they are loaded.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            filenames = []
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                filenames.extend(os.path.join(root, name) for name in sorted(files) if name.endswith(EXTENSIONS))
+        else:
+            filenames = [path]
+
+        for filename in filenames:
+            if is_session_file(filename):
+                session_file = SessionFile(filename)
+                keys = session_file.trace_keys()
+                session_file.close()
+                for key in keys:
+                    yield filename, key
+            else:
+                yield filename, None
+
+
+def _get_session_file(filename):
+    global _session_file
+    if _session_file is None or _session_file.filename != filename:
+        if _session_file is not None:
+            _session_file.close()
+        _session_file = SessionFile(filename)
+    return _session_file
+
+
+def _load_pickle(filename):
+    with open(filename, "rb") as fp:
+        if filename.endswith(".gz"):
+            return pickle.loads(gzip.decompress(fp.read()))
+        return pickle.load(fp)
+
+
+def _get_metrics(run_metadata, device_pattern, exclude_pattern):
+    return Timeline(run_metadata=run_metadata).summary(device_pattern, exclude_pattern)
+
+
+def analyze_trace(task):
+    """
+    Computes the metrics of one task of :func:`find_traces`.
+
+    Args:
+        task (tuple): (path, key, device_pattern, exclude_pattern).
+
+    Returns:
+        list: one dict with ``FIELDS`` per trace. Failures are reported in the "error" field.
+    """
+    filename, key, device_pattern, exclude_pattern = task
+    try:
+        if key is not None:
+            from tensorflow import RunMetadata
+            data = _get_session_file(filename).get_trace_bytes(key)
+            traces = [(key, RunMetadata.FromString(data))]
+        else:
+            loaded = _load_pickle(filename)
+            if hasattr(loaded, "step_stats"):
+                traces = [((None, None), loaded)]
+            else:
+                # A pickled tracing session
+                traces = ((trace_key, loaded.get_trace(*trace_key)) for trace_key in loaded.get_trace_keys())
+
+        rows = []
+        for (run_id, trace_id), run_metadata in traces:
+            row = dict(file=filename, run_id=run_id, trace_id=trace_id, error=None)
+            row.update(_get_metrics(run_metadata, device_pattern, exclude_pattern))
+            rows.append(row)
+        return rows
+    except Exception as ex:
+        return [dict(file=filename, run_id=key[0] if key else None, trace_id=key[1] if key else None,
+                     error="{}: {}".format(type(ex).__name__, ex))]
+
+
+def analyze(paths, fp, output_format="csv", jobs=None, device_pattern=None, exclude_pattern=None,
+            max_tasks_per_child=100):
+    """
+    Computes the metrics of every trace in ``paths`` with a pool of ``jobs`` processes and writes a row per trace to
+    ``fp`` as soon as it is computed, so rows are not in input order. Workers load one trace at a time and are
+    replaced after ``max_tasks_per_child`` tasks to keep their memory bounded.
+
+    Args:
+        paths (list): files and directories.
+        fp: a text file object.
+        output_format (str): "csv", or "json" for one JSON object per line. (default: "csv")
+        jobs (int): number of worker processes. (default: number of CPUs)
+        device_pattern (str): only devices whose name contains this pattern are included.
+        exclude_pattern (str): ops whose description contains this pattern are excluded.
+        max_tasks_per_child (int): tasks after which a worker process is replaced. (default: 100)
+
+    Returns:
+        int: number of traces that could not be analyzed.
+    """
+    if output_format == "csv":
+        writer = csv.DictWriter(fp, FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        write = writer.writerow
+    elif output_format == "json":
+        def write(row):
+            fp.write(json.dumps(row) + "\n")
+    else:
+        raise ValueError("Unknown output format: {}".format(output_format))
+
+    tasks = ((filename, key, device_pattern, exclude_pattern) for filename, key in find_traces(paths))
+    errors = 0
+    pool = multiprocessing.Pool(jobs, maxtasksperchild=max_tasks_per_child)
+    try:
+        for rows in pool.imap_unordered(analyze_trace, tasks):
+            for row in rows:
+                errors += row["error"] is not None
+                write(row)
+            fp.flush()
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return errors
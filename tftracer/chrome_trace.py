@@ -0,0 +1,74 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+from __future__ import absolute_import
+
+import json
+
+__author__ = 'Sayed Hadi Hashemi'
+
+CHUNK_SIZE = 10000
+
+
+def iter_chrome_trace(data_loader, chunk_size=CHUNK_SIZE):
+    """
+    Generates a trace in the Chrome trace-event JSON format, readable by ``chrome://tracing`` and Perfetto, in chunks
+    of at most ``chunk_size`` events.
+
+    Each device becomes a process. The rows of its op and communication lanes, as laid out by
+    :func:`tftracer.timeline_visualizer.DataLoader.get_data`, become its threads.
+
+    Args:
+        data_loader (DataLoader): the source of events.
+        chunk_size (int): number of events per chunk.
+
+    Yields:
+        str: consecutive pieces of the JSON document.
+    """
+    lanes = data_loader.get_data()
+    base_timestamp = min([lane["events"].base_timestamp for lane in lanes]) if lanes else 0
+    yield '{"displayTimeUnit": "ms", "traceEvents": [\n'
+
+    separator = ""
+    processes = {}
+    for lane in lanes:
+        events = lane["events"]
+        device_name = events.devices[events.device[0]]
+        if device_name not in processes:
+            processes[device_name] = [len(processes) + 1, 0]
+            metadata = [
+                dict(name="process_name", ph="M", pid=processes[device_name][0], args=dict(name=device_name)),
+                dict(name="process_sort_index", ph="M", pid=processes[device_name][0],
+                     args=dict(sort_index=processes[device_name][0])),
+            ]
+            yield separator + ",\n".join(json.dumps(event) for event in metadata)
+            separator = ",\n"
+        pid, base_tid = processes[device_name]
+        processes[device_name][1] += max(lane["n_rows"], 1)
+
+        lane_name = "Communication" if lane["name"].endswith(" (Communication)") else "Ops"
+        yield separator + ",\n".join(
+            json.dumps(dict(name="thread_name", ph="M", pid=pid, tid=base_tid + row,
+                            args=dict(name="{} #{}".format(lane_name, row))))
+            for row in range(max(lane["n_rows"], 1)))
+
+        start = (events.start_micros - base_timestamp).tolist()
+        duration = events.end_rel_micros.tolist()
+        tid = (events.row + base_tid).tolist()
+        name = events.name.decode()
+        op = events.op.decode()
+        description = events.description.decode()
+        for chunk_start in range(0, len(events), chunk_size):
+            yield separator + ",\n".join(
+                json.dumps(dict(name=name[i], cat=op[i], ph="X", ts=start[i], dur=duration[i], pid=pid, tid=tid[i],
+                                args=dict(op=op[i], description=description[i])))
+                for i in range(chunk_start, min(chunk_start + chunk_size, len(events))))
+
+    yield "\n]}\n"
+
+
+def write_chrome_trace(fp, data_loader):
+    """
+    Writes a trace in the Chrome trace-event JSON format to a text file object, one chunk at a time.
+    """
+    for chunk in iter_chrome_trace(data_loader):
+        fp.write(chunk)
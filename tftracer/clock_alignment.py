@@ -0,0 +1,145 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+"""
+Aligns the clocks of traces captured on different hosts.
+
+Timestamps of ``NodeExecStats`` come from the clock of the host that ran the op. When the traces of several hosts are
+combined (e.g. by :class:`tftracer.CollectorClient` or a distributed job), their clocks are skewed. An offset in
+microseconds is added to the timestamps of each host; offsets are either given or estimated from the trace:
+
+* ``HorovodAllreduce`` ops of the same name finish at about the same time on every rank, so the offset of a host is
+  the median difference between its end times and those of the reference host.
+* A ``_Recv`` cannot finish before the matching ``_Send`` starts, which bounds the offset between two hosts.
+
+The host of a device is its name up to ``/device:``, e.g. ``rank1:/job:worker/replica:0/task:1``.
+"""
+from __future__ import division
+from __future__ import absolute_import
+
+import re
+
+import numpy as np
+
+__author__ = 'Sayed Hadi Hashemi'
+
+_RANK_PREFIX_RE = re.compile(r"^rank\d+:")
+_SEND_RECV_RE = re.compile(r"= _(?:Host)?(Send|Recv)\((\S+) @([^)\s]+)")
+
+
+def get_host(device_name):
+    """
+    Returns:
+        str: the host part of a device name.
+    """
+    index = device_name.find("/device:")
+    return device_name[:index] if index >= 0 else device_name
+
+
+def get_device_offsets(devices, clock_offsets):
+    """
+    Args:
+        devices (list): device names.
+        clock_offsets (dict): offsets in microseconds by device name or by host.
+
+    Returns:
+        numpy.ndarray: the int64 offset of each device; devices without an offset get 0.
+    """
+    return np.array([clock_offsets.get(device, clock_offsets.get(get_host(device), 0)) for device in devices],
+                    dtype=np.int64)
+
+
+def _allreduce_offsets(table, hosts, device_host):
+    """Median end-time difference of same-named allreduce ops between each host and host 0."""
+    mask = table.description_mask(" = HorovodAllreduce(")
+    if not mask.any():
+        return {}
+    ends = np.full((len(hosts), len(table.name.categories)), -1, dtype=np.int64)
+    np.maximum.at(ends, (device_host[table.device[mask]], table.name.codes[mask]), table.end_micros[mask])
+    offsets = {}
+    for host in range(1, len(hosts)):
+        matched = (ends[0] >= 0) & (ends[host] >= 0)
+        if matched.any():
+            offsets[host] = int(np.median(ends[0][matched] - ends[host][matched]))
+    return offsets
+
+
+def _send_recv_bounds(table, hosts, device_host):
+    """
+    Returns:
+        dict: ``(sender, receiver) -> bound`` such that ``offset[receiver] - offset[sender] >= bound``.
+    """
+    labels = {}
+    for code, label in enumerate(table.description.categories):
+        match = _SEND_RECV_RE.search(label)
+        if match is not None:
+            labels[code] = match.groups()
+    if not labels:
+        return {}
+
+    sends = {}
+    recvs = {}
+    starts = table.start_micros.tolist()
+    ends = table.end_micros.tolist()
+    for i in np.flatnonzero(np.isin(table.description.codes, list(labels))).tolist():
+        kind, tensor_name, peer = labels[table.description.codes[i]]
+        device = table.devices[table.device[i]]
+        local = _RANK_PREFIX_RE.sub("", device)
+        if get_host(local) == get_host(peer):
+            continue
+        host = device_host[table.device[i]]
+        # Repeated transfers of a tensor keep the earliest send and the latest receive, the weakest bound.
+        if kind == "Send":
+            key = (tensor_name, local, peer)
+            sends[key] = (min(sends[key][0], starts[i]) if key in sends else starts[i], host)
+        else:
+            key = (tensor_name, peer, local)
+            recvs[key] = (max(recvs[key][0], ends[i]) if key in recvs else ends[i], host)
+
+    bounds = {}
+    for key, (send_start, sender) in sends.items():
+        if key in recvs:
+            recv_end, receiver = recvs[key]
+            pair = (sender, receiver)
+            bounds[pair] = max(bounds.get(pair, send_start - recv_end), send_start - recv_end)
+    return bounds
+
+
+def estimate_clock_offsets(table):
+    """
+    Estimates the clock offset of each host relative to the host of the first device.
+
+    Args:
+        table (tftracer.event_table.EventTable): the events of all hosts.
+
+    Returns:
+        dict: offset in microseconds by host. Hosts with no matched ops get 0.
+    """
+    hosts = []
+    device_host = np.array([_index(hosts, get_host(device)) for device in table.devices], dtype=np.int64)
+    if len(hosts) < 2:
+        return {host: 0 for host in hosts}
+
+    estimates = _allreduce_offsets(table, hosts, device_host)
+    bounds = _send_recv_bounds(table, hosts, device_host)
+    offsets = {hosts[0]: 0}
+    for host in range(1, len(hosts)):
+        lower = bounds.get((0, host), None)
+        upper = -bounds[(host, 0)] if (host, 0) in bounds else None
+        if host in estimates:
+            offset = estimates[host]
+        elif lower is not None and upper is not None:
+            offset = (lower + upper) // 2
+        else:
+            offset = lower if lower is not None else upper if upper is not None else 0
+        if lower is not None and (upper is None or lower <= upper):
+            offset = max(offset, lower)
+        if upper is not None and (lower is None or lower <= upper):
+            offset = min(offset, upper)
+        offsets[hosts[host]] = int(offset)
+    return offsets
+
+
+def _index(values, value):
+    if value not in values:
+        values.append(value)
+    return values.index(value)
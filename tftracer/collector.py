@@ -0,0 +1,203 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+"""
+Collects traces from the workers of a distributed job (e.g. the ranks of a horovod job) into one
+:class:`tftracer.TracingServer`.
+
+Each worker traces the same steps, decided by a deterministic :class:`tftracer.TracingPolicy`, and sends the traces
+in batches to the ``/collect`` route of the server. The server merges the traces of the same global step of a run into
+one trace whose devices are prefixed with ``rank{rank}:``. Without a global step in the graph, the count of the run's
+steps on each worker is used instead, which lines up only if every worker runs the same steps from the start.
+
+A batch is zlib-compressed and holds consecutive items of:
+
+    header: length of the metadata (uint32), length of the trace (uint32)
+    metadata: JSON with run_key, info, step, global_step, rank and runtime
+    trace: a serialized ``RunMetadata``
+"""
+import atexit
+import json
+import logging
+import queue
+import struct
+import threading
+import zlib
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+
+from .tracing_policy import EveryNStepsPolicy
+
+__author__ = 'Sayed Hadi Hashemi'
+
+_ITEM = struct.Struct("<II")
+
+
+def encode_batch(items):
+    """
+    Args:
+        items: list of (metadata, serialized trace) tuples.
+
+    Returns:
+        bytes: the body of a ``/collect`` request.
+    """
+    chunks = []
+    for metadata, data in items:
+        metadata = json.dumps(metadata).encode("utf-8")
+        chunks.append(_ITEM.pack(len(metadata), len(data)))
+        chunks.append(metadata)
+        chunks.append(data)
+    return zlib.compress(b"".join(chunks))
+
+
+def decode_batch(body):
+    """
+    The inverse of :func:`encode_batch`.
+
+    Raises:
+        ValueError: if the body is not a valid batch.
+    """
+    try:
+        body = zlib.decompress(body)
+    except zlib.error:
+        raise ValueError("Not a trace batch")
+    offset = 0
+    items = []
+    while offset < len(body):
+        if offset + _ITEM.size > len(body):
+            raise ValueError("Truncated trace batch")
+        metadata_length, data_length = _ITEM.unpack_from(body, offset)
+        offset += _ITEM.size
+        if offset + metadata_length + data_length > len(body):
+            raise ValueError("Truncated trace batch")
+        metadata = json.loads(body[offset:offset + metadata_length].decode("utf-8"))
+        offset += metadata_length
+        items.append((metadata, body[offset:offset + data_length]))
+        offset += data_length
+    return items
+
+
+class CollectorClient:
+    """
+    Sends the traces of a worker to a :class:`tftracer.TracingServer`. Use :attr:`hook` in place of
+    ``TracingServer.hook`` on every worker.
+
+    The hook never waits on the network: traces are queued and sent by a background thread in batches of up to
+    ``batch_size`` traces, at least every ``flush_interval`` seconds. When the queue is full or the server cannot be
+    reached, traces are dropped.
+
+    Example:
+
+        .. code-block:: python
+
+            hvd.init()
+            if hvd.rank() == 0:
+                tracing_server = TracingServer()
+            collector = CollectorClient("http://10.0.0.1:9999", rank=hvd.rank())
+            with tf.train.MonitoredTrainingSession(hooks=[collector.hook]):
+                ...
+
+    Args:
+        server_url (str): address of the tracing server, e.g. "http://127.0.0.1:9999".
+        rank (int): the rank of this worker.
+        tracing_policy (tftracer.TracingPolicy): which steps to trace. It must choose the same steps on every worker,
+        so random policies do not work. (default: EveryNStepsPolicy(100))
+        max_queue (int): number of traces waiting to be sent. (default: 64)
+        batch_size (int): maximum number of traces per request. (default: 8)
+        flush_interval (float): maximum seconds a trace waits for a batch to fill. (default: 1.0)
+        timeout (float): timeout of each request in seconds. (default: 10)
+        partition_graphs (bool): also records the partition graphs of traced steps, needed by the critical path of
+        the timelines. (default: False)
+    """
+    def __init__(self, server_url, rank, tracing_policy=None, max_queue=64, batch_size=8, flush_interval=1.0,
+                 timeout=10, partition_graphs=False):
+        self._url = server_url.rstrip("/") + "/collect"
+        self.rank = rank
+        self._tracing_policy = tracing_policy if tracing_policy is not None else EveryNStepsPolicy(100)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._timeout = timeout
+        self._partition_graphs = partition_graphs
+        self._hook = None
+        self._closed = False
+        self.sent = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="tftracer-collector")
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def hook(self):
+        """
+        Returns a ``tensorflow.train.SessionRunHook`` object which traces the steps chosen by the tracing policy and
+        submits them.
+        """
+        if self._hook is None:
+            from .tracing_hook import CollectorHook
+            self._hook = CollectorHook(self, self._tracing_policy, self._partition_graphs)
+        return self._hook
+
+    def submit(self, run_key, info, step, runtime, run_metadata, global_step=None):
+        """
+        Queues a trace for sending without blocking.
+
+        Args:
+            run_key (str): identifies the run; it must be the same on every worker.
+            info (dict): fetches, feeds and options of the run as shown in the web interface.
+            step (int): the step of the run on this worker.
+            runtime (float): the runtime of the step in seconds.
+            run_metadata (tf.RunMetadata): the trace.
+            global_step (int): the global step after the run, if any. Traces of the same global step, or else of the
+            same ``step``, are merged. (default: None)
+        """
+        metadata = {"run_key": run_key, "info": info, "step": step, "global_step": global_step, "rank": self.rank,
+                    "runtime": runtime}
+        try:
+            self._queue.put_nowait((metadata, run_metadata))
+        except queue.Full:
+            self.dropped += 1
+
+    def _next_batch(self):
+        try:
+            item = self._queue.get(timeout=self._flush_interval)
+        except queue.Empty:
+            return [], False
+        batch = []
+        while item is not None:
+            batch.append(item)
+            if len(batch) >= self._batch_size:
+                return batch, False
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return batch, False
+        return batch, True
+
+    def _send(self, batch):
+        body = encode_batch([(metadata, run_metadata.SerializeToString()) for metadata, run_metadata in batch])
+        request = Request(self._url, data=body, headers={"Content-Type": "application/octet-stream"})
+        try:
+            urlopen(request, timeout=self._timeout).close()
+            self.sent += len(batch)
+        except (URLError, OSError) as e:
+            self.dropped += len(batch)
+            logging.getLogger("tensorflow").warning("Tracing Collector: failed to send {} traces to {}: {}".format(
+                len(batch), self._url, e))
+
+    def _run(self):
+        done = False
+        while not done:
+            batch, done = self._next_batch()
+            if batch:
+                self._send(batch)
+
+    def close(self):
+        """
+        Sends the queued traces and stops the background thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
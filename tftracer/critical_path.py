@@ -0,0 +1,140 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+"""
+Critical path and slack of a traced step.
+
+The dependencies between ops come from ``RunMetadata.partition_graphs`` (requested with
+``RunOptions(output_partition_graphs=True)``): the inputs of every node, plus an edge from each ``_Send`` to the
+``_Recv`` of the same tensor in another partition. The timings come from ``step_stats``; a node that ran on several
+streams spans from its earliest start to its latest end.
+
+* The critical path is the chain of last-arriving dependencies: starting from the op that finished last, each op is
+  preceded by the input that finished last.
+* The slack of an op is how much later it could have finished without delaying the end of the step, given the
+  dependencies alone (waiting for a free stream or thread is not a dependency).
+
+Both are computed in time linear in the size of the graph. Nodes in cycles (e.g. ``while`` loops) are ignored.
+"""
+from collections import deque
+
+__author__ = 'Sayed Hadi Hashemi'
+
+_SEND_OPS = ("_Send", "_HostSend")
+_RECV_OPS = ("_Recv", "_HostRecv")
+
+
+def get_node_times(step_stats):
+    """
+    Returns:
+        dict: ``node_name -> (start, end, device)`` in microseconds, covering all the events of a node.
+    """
+    times = {}
+    for dev_stats in step_stats.dev_stats:
+        for node in dev_stats.node_stats:
+            start = node.all_start_micros
+            end = start + node.all_end_rel_micros
+            if node.node_name in times:
+                old_start, old_end, device = times[node.node_name]
+                times[node.node_name] = (min(start, old_start), max(end, old_end), device)
+            else:
+                times[node.node_name] = (start, end, dev_stats.device)
+    return times
+
+
+def get_dependencies(partition_graphs):
+    """
+    Returns:
+        dict: ``node_name -> list of the names of the nodes it depends on``.
+    """
+    inputs = {}
+    sends = {}
+    recvs = []
+    for graph in partition_graphs:
+        for node in graph.node:
+            inputs[node.name] = [name.lstrip("^").split(":")[0] for name in node.input]
+            if node.op in _SEND_OPS:
+                sends[node.attr["tensor_name"].s] = node.name
+            elif node.op in _RECV_OPS:
+                recvs.append((node.attr["tensor_name"].s, node.name))
+    for tensor_name, name in recvs:
+        if tensor_name in sends:
+            inputs[name].append(sends[tensor_name])
+    return inputs
+
+
+def _topological_order(inputs):
+    outputs = {name: [] for name in inputs}
+    pending = {}
+    for name, node_inputs in inputs.items():
+        node_inputs = [node_input for node_input in node_inputs if node_input in inputs]
+        inputs[name] = node_inputs
+        pending[name] = len(node_inputs)
+        for node_input in node_inputs:
+            outputs[node_input].append(name)
+
+    ready = deque(name for name, count in pending.items() if count == 0)
+    order = []
+    while ready:
+        name = ready.popleft()
+        order.append(name)
+        for output in outputs[name]:
+            pending[output] -= 1
+            if pending[output] == 0:
+                ready.append(output)
+    return order, outputs
+
+
+def analyze_critical_path(run_metadata):
+    """
+    Computes the critical path and the slack of every op of a step.
+
+    Args:
+        run_metadata (tensorflow.RunMetadata): a trace with ``partition_graphs``.
+
+    Returns:
+        dict: ``path``, the ops of the critical path in execution order as dicts of name, device, start and end in
+        microseconds; ``length``, the time from the start of the first op of the path to the end of the last one;
+        ``slack``, the slack of every timed op in microseconds by node name.
+    """
+    times = get_node_times(run_metadata.step_stats)
+    inputs = get_dependencies(run_metadata.partition_graphs)
+    order, outputs = _topological_order(inputs)
+
+    # Forward: the input each node waited for last. Untimed nodes pass their inputs through.
+    ready_at = {}
+    waited_for = {}
+    for name in order:
+        last = None
+        for node_input in inputs[name]:
+            if ready_at.get(node_input, None) is not None and (last is None or ready_at[node_input] > ready_at[last]):
+                last = node_input
+        waited_for[name] = last
+        ready_at[name] = times[name][1] if name in times else (ready_at[last] if last is not None else None)
+
+    timed = [name for name in order if name in times]
+    if not timed:
+        return dict(path=[], length=0, slack={})
+
+    path = []
+    name = max(timed, key=lambda timed_name: times[timed_name][1])
+    while name is not None:
+        if name in times:
+            start, end, device = times[name]
+            path.append(dict(name=name, device=device, start=start, end=end))
+        name = waited_for[name]
+    path.reverse()
+
+    # Backward: the latest each node could have finished without delaying the end of the step.
+    step_end = max(times[timed_name][1] for timed_name in timed)
+    latest_start = {}
+    slack = {}
+    for name in reversed(order):
+        latest_end = min([latest_start[output] for output in outputs[name]] or [step_end])
+        if name in times:
+            start, end, _ = times[name]
+            slack[name] = max(latest_end - end, 0)
+            latest_start[name] = latest_end - (end - start)
+        else:
+            latest_start[name] = latest_end
+
+    return dict(path=path, length=path[-1]["end"] - path[0]["start"], slack=slack)
@@ -0,0 +1,228 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+from __future__ import division
+from __future__ import absolute_import
+
+import heapq
+
+import numpy as np
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+def assign_rows(start, end):
+    """
+    Packs intervals into rows so that events on the same row do not overlap. Each event, in order of its start time,
+    takes the lowest-numbered row that is free by then, which gives the same layout as a first-fit scan over the rows
+    in O(n log k) for k rows.
+
+    Args:
+        start (numpy.ndarray): start times.
+        end (numpy.ndarray): end times.
+
+    Returns:
+        tuple: (rows, n_rows) where ``rows`` is an int32 array with the row of each event.
+    """
+    order = np.argsort(start, kind="stable")
+    rows = np.zeros(len(start), dtype=np.int32)
+    busy = []
+    free = []
+    n_rows = 0
+    sorted_rows = []
+    for event_start, event_end in zip(start[order].tolist(), end[order].tolist()):
+        while busy and busy[0][0] <= event_start:
+            heapq.heappush(free, heapq.heappop(busy)[1])
+        if free:
+            row = heapq.heappop(free)
+        else:
+            row = n_rows
+            n_rows += 1
+        heapq.heappush(busy, (event_end, row))
+        sorted_rows.append(row)
+    rows[order] = sorted_rows
+    return rows, n_rows
+
+
+def get_node_stats(step_stats, node_index):
+    """
+    Returns the ``NodeExecStats`` at position ``node_index`` of ``step_stats.dev_stats``, counting all devices.
+
+    Raises:
+        IndexError: if node_index is out of range.
+    """
+    if node_index >= 0:
+        for dev_stats in step_stats.dev_stats:
+            if node_index < len(dev_stats.node_stats):
+                return dev_stats.node_stats[node_index]
+            node_index -= len(dev_stats.node_stats)
+    raise IndexError("node index out of range")
+
+
+class StringColumn:
+    """
+    A dictionary-encoded column of strings: each row stores an index into ``categories``.
+    """
+    def __init__(self, codes, categories):
+        self.codes = codes
+        self.categories = categories
+
+    @classmethod
+    def encode(cls, values):
+        index = {}
+        codes = np.fromiter((index.setdefault(value, len(index)) for value in values), dtype=np.int32,
+                            count=len(values))
+        return cls(codes, list(index))
+
+    def take(self, indices):
+        return StringColumn(self.codes[indices], self.categories)
+
+    def map(self, func):
+        """Applies func once per distinct value and returns the resulting column."""
+        return StringColumn(self.codes, [func(value) for value in self.categories])
+
+    def decode(self):
+        categories = np.empty(len(self.categories), dtype=object)
+        categories[:] = self.categories
+        return categories[self.codes]
+
+    def __len__(self):
+        return len(self.codes)
+
+
+class EventTable:
+    """
+    A columnar store of the ``node_stats`` of a ``tensorflow.StepStats``.
+
+    Events refer back to their ``NodeExecStats`` through ``node_index``, the position of the node in
+    ``step_stats.dev_stats`` counting all devices, see :func:`get_node_stats`.
+
+    Times are kept twice: ``start_micros``/``end_micros`` are the raw int64 timestamps used by the analytics while
+    ``start``/``end``/``duration`` are milliseconds relative to ``base_timestamp`` as shown in the timeline.
+    """
+    def __init__(self, start_micros, end_rel_micros, device, devices, name, description, is_comm, node_index,
+                 base_timestamp=None):
+        self.start_micros = start_micros
+        self.end_rel_micros = end_rel_micros
+        self.device = device
+        self.devices = devices
+        self.name = name
+        self.description = description
+        self.is_comm = is_comm
+        self.node_index = node_index
+        self.row = np.zeros(len(start_micros), dtype=np.int32)
+        self.op = None
+        self.inputs = None
+        self.color = None
+        self.critical = None
+        self.slack = None
+        if base_timestamp is None:
+            base_timestamp = int(start_micros.min()) if len(start_micros) > 0 else 0
+        self.base_timestamp = base_timestamp
+
+    @classmethod
+    def from_step_stats(cls, step_stats, device_filter=None, comm_op_name="RecvTensor"):
+        """
+        Builds the table in a single pass over ``step_stats.dev_stats``.
+
+        Args:
+            step_stats (tensorflow.StepStats): the source of events.
+            device_filter (callable): if set, only devices for which ``device_filter(device_name)`` is true are loaded.
+            comm_op_name (str): node name of the communication ops (besides ``HorovodAllreduce``).
+        """
+        devices = []
+        start_micros = []
+        end_rel_micros = []
+        device = []
+        names = []
+        descriptions = []
+        is_comm = []
+        node_index = []
+        offset = 0
+        for dev_stats in step_stats.dev_stats:
+            num_nodes = len(dev_stats.node_stats)
+            offset += num_nodes
+            if device_filter is not None and not device_filter(dev_stats.device):
+                continue
+            node_index.extend(range(offset - num_nodes, offset))
+            device_id = len(devices)
+            devices.append(dev_stats.device)
+            for node in dev_stats.node_stats:
+                label = node.timeline_label
+                start_micros.append(node.all_start_micros)
+                end_rel_micros.append(node.all_end_rel_micros)
+                device.append(device_id)
+                names.append(node.node_name)
+                descriptions.append(label)
+                is_comm.append(" = HorovodAllreduce(" in label or node.node_name == comm_op_name)
+
+        return cls(
+            start_micros=np.array(start_micros, dtype=np.int64),
+            end_rel_micros=np.array(end_rel_micros, dtype=np.int64),
+            device=np.array(device, dtype=np.int32),
+            devices=devices,
+            name=StringColumn.encode(names),
+            description=StringColumn.encode(descriptions),
+            is_comm=np.array(is_comm, dtype=np.bool_),
+            node_index=np.array(node_index, dtype=np.int64),
+        )
+
+    @property
+    def end_micros(self):
+        return self.start_micros + self.end_rel_micros
+
+    @property
+    def start(self):
+        return (self.start_micros - self.base_timestamp) / 1000
+
+    @property
+    def end(self):
+        return (np.maximum(self.end_rel_micros, 1) + self.start_micros - self.base_timestamp) / 1000
+
+    @property
+    def duration(self):
+        return self.end_rel_micros / 1000
+
+    def shift(self, device_offsets):
+        """
+        Adds ``device_offsets[device]`` microseconds to the start of every event and updates ``base_timestamp``.
+        Used to align the clocks of different hosts, see :mod:`tftracer.clock_alignment`.
+        """
+        self.start_micros = self.start_micros + device_offsets[self.device]
+        self.base_timestamp = int(self.start_micros.min()) if len(self.start_micros) > 0 else 0
+
+    def device_mask(self, device_search=""):
+        """Returns a boolean mask of the events whose device name contains ``device_search``."""
+        matched = [i for i, device_name in enumerate(self.devices) if device_search in device_name]
+        return np.isin(self.device, matched)
+
+    def description_mask(self, pattern):
+        """Returns a boolean mask of the events whose description contains ``pattern``."""
+        matched = np.array([pattern in label for label in self.description.categories], dtype=np.bool_)
+        return matched[self.description.codes] if len(matched) > 0 else np.zeros(len(self), dtype=np.bool_)
+
+    def take(self, indices):
+        """Returns a new table with the selected rows. String categories are shared with this table."""
+        table = EventTable(
+            start_micros=self.start_micros[indices],
+            end_rel_micros=self.end_rel_micros[indices],
+            device=self.device[indices],
+            devices=self.devices,
+            name=self.name.take(indices),
+            description=self.description.take(indices),
+            is_comm=self.is_comm[indices],
+            node_index=self.node_index[indices],
+            base_timestamp=self.base_timestamp,
+        )
+        table.row = self.row[indices]
+        for column in ("op", "inputs", "color"):
+            value = getattr(self, column)
+            if value is not None:
+                setattr(table, column, value.take(indices))
+        for column in ("critical", "slack"):
+            value = getattr(self, column)
+            if value is not None:
+                setattr(table, column, value[indices])
+        return table
+
+    def __len__(self):
+        return len(self.start_micros)
@@ -0,0 +1,188 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+"""
+Static export of a tracing session: one HTML timeline per trace, an index page and one shared copy of the Bokeh
+resources, rendered in parallel. A manifest of content hashes lets a later export of the same session skip the traces
+that did not change.
+"""
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from jinja2 import Environment, FileSystemLoader
+
+from .session_file import SessionFile, is_session_file
+from .version import __version__
+
+__author__ = 'Sayed Hadi Hashemi'
+
+MANIFEST = "manifest.json"
+RESOURCES_URL = "bokeh/"
+
+
+def _trace_filename(key):
+    return "trace-{}-{}.html".format(*key)
+
+
+def copy_resources(out_dir):
+    """
+    Copies the Bokeh JS/CSS that the exported pages reference to ``out_dir/bokeh/static``, unless already there.
+    """
+    from bokeh.resources import Resources
+    from .timeline_visualizer import get_resources_dir
+
+    resources = Resources(mode="server", root_url=RESOURCES_URL)
+    for url in resources.js_files + resources.css_files:
+        path = url.split("?")[0][len(RESOURCES_URL + "static/"):]
+        source = os.path.join(get_resources_dir(), path)
+        target = os.path.join(out_dir, RESOURCES_URL, "static", path)
+        if not os.path.exists(target) or os.path.getsize(target) != os.path.getsize(source):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+
+
+def _get_hash(data, options):
+    import bokeh
+    digest = hashlib.sha1(data)
+    digest.update(json.dumps([__version__, bokeh.__version__, options], sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _render_trace(task):
+    """
+    Renders one trace unless its hash matches the previous export.
+
+    Returns:
+        tuple: (key, hash, status) where status is "rendered", "skipped" or an error message.
+    """
+    session_filename, key, out_dir, previous_hash, options = task
+    try:
+        from tensorflow import RunMetadata
+        from .timeline_visualizer import DataLoader, TimelineVisualizer
+
+        session_file = SessionFile(session_filename)
+        try:
+            data = session_file.get_trace_bytes(key)
+        finally:
+            session_file.close()
+        content_hash = _get_hash(data, options)
+        output_file = os.path.join(out_dir, _trace_filename(key))
+        if content_hash == previous_hash and os.path.exists(output_file):
+            return key, content_hash, "skipped"
+
+        data_loader = DataLoader(RunMetadata.FromString(data), options["device_pattern"])
+        visualizer = TimelineVisualizer(data_loader, embed_details=options["embed_details"],
+                                        resources_url=RESOURCES_URL, single_canvas=options["single_canvas"])
+        # Written aside and renamed, so an interrupted export never leaves a truncated page.
+        fd, temp_file = tempfile.mkstemp(suffix=".html", dir=out_dir)
+        os.close(fd)
+        try:
+            visualizer.visualize(temp_file)
+            os.replace(temp_file, output_file)
+        except BaseException:
+            os.remove(temp_file)
+            raise
+        return key, content_hash, "rendered"
+    except Exception as ex:
+        return key, None, "{}: {}".format(type(ex).__name__, ex)
+
+
+def _write_index(out_dir, runs, exported):
+    template_env = Environment(
+        loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'resources/templates/')),
+    )
+    for run in runs:
+        run["exported"] = [
+            dict(trace, url=_trace_filename((run["run_id"], trace["trace_id"])))
+            for trace in run["traces"] if (run["run_id"], trace["trace_id"]) in exported
+        ]
+    html = template_env.get_template("export_index.html").render(
+        runs=[run for run in runs if run["exported"]],
+        header=str(datetime.datetime.now()),
+        version=__version__,
+    )
+    with open(os.path.join(out_dir, "index.html"), "w") as fp:
+        fp.write(html)
+
+
+def export_session(filename, out_dir, jobs=None, device_pattern=None, embed_details=False, single_canvas=False,
+                   force=False, max_tasks_per_child=20, log=None):
+    """
+    Exports every trace of a tracing session to ``out_dir`` as standalone HTML pages referencing one shared copy of
+    the Bokeh resources, plus an ``index.html`` listing them. Traces are rendered by a pool of ``jobs`` processes.
+
+    A trace whose content and export options are unchanged since the last export to ``out_dir`` is not rendered
+    again, unless ``force`` is set.
+
+    Args:
+        filename (str): a session file or a pickled session.
+        out_dir (str): the output directory; created if missing.
+        jobs (int): number of worker processes. (default: number of CPUs)
+        device_pattern (str): a regex pattern used to choose which device to be included.
+        embed_details (bool): embeds the full ``NodeExecStats`` of every op, shown when an op is clicked.
+        single_canvas (bool): draws all devices of a trace into one figure.
+        force (bool): renders every trace even if unchanged.
+        max_tasks_per_child (int): traces after which a worker process is replaced. (default: 20)
+        log (callable): called with a progress message per trace.
+
+    Returns:
+        dict: number of traces by status ("rendered", "skipped" or "failed").
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_file = os.path.join(out_dir, MANIFEST)
+    manifest = {"traces": {}}
+    if os.path.exists(manifest_file) and not force:
+        with open(manifest_file) as fp:
+            manifest = json.load(fp)
+
+    converted = None
+    if not is_session_file(filename):
+        # Pickled sessions are converted once, so that workers read single traces from an indexed file.
+        from .tracing_server import TracingServer
+        server = TracingServer(start_web_server_on_start=False)
+        server.load_session(filename)
+        fd, converted = tempfile.mkstemp(suffix=".tftrace")
+        os.close(fd)
+        server.save_session(converted)
+        filename = converted
+
+    try:
+        session_file = SessionFile(filename)
+        keys = session_file.trace_keys()
+        state = session_file.get_runs() or {"runs": []}
+        session_file.close()
+
+        copy_resources(out_dir)
+        options = dict(device_pattern=device_pattern, embed_details=embed_details, single_canvas=single_canvas)
+        tasks = [(filename, key, out_dir, manifest["traces"].get("{}-{}".format(*key), None), options)
+                 for key in keys]
+        counts = {"rendered": 0, "skipped": 0, "failed": 0}
+        traces = {}
+        pool = multiprocessing.Pool(jobs, maxtasksperchild=max_tasks_per_child)
+        try:
+            for key, content_hash, status in pool.imap_unordered(_render_trace, tasks):
+                if content_hash is None:
+                    counts["failed"] += 1
+                else:
+                    counts[status] += 1
+                    traces["{}-{}".format(*key)] = content_hash
+                if log is not None:
+                    log("{}: {}".format(_trace_filename(key), status))
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    finally:
+        if converted is not None:
+            os.remove(converted)
+
+    _write_index(out_dir, state["runs"], {tuple(int(i) for i in key.split("-")) for key in traces})
+    with open(manifest_file, "w") as fp:
+        json.dump({"tftracer_version": __version__, "traces": traces}, fp, indent=1, sort_keys=True)
+    return counts
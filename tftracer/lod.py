@@ -0,0 +1,117 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+"""
+Levels of detail for timelines too large to send to the browser at once.
+
+At a given zoom level, ops of a row narrower than a pixel and falling into the same pixel cannot be told apart. A
+:class:`LanePyramid` precomputes, for a series of resolutions, the events of a lane with such ops merged into
+aggregates, so the events of any visible window are selected with two binary searches.
+"""
+from __future__ import division
+from __future__ import absolute_import
+
+import numpy as np
+
+__author__ = 'Sayed Hadi Hashemi'
+
+# Timestamps of a trace are in microseconds; no level is finer than that.
+TRACE_RESOLUTION = 0.001
+
+
+class LanePyramid:
+    """
+    Precomputed levels of detail of a timeline lane.
+
+    Level ``k`` has a resolution of ``span / plot_width / factor ** k`` milliseconds, i.e. one pixel of a plot
+    ``factor ** k`` times zoomed in. It merges the consecutive ops of a row that are narrower than the resolution and
+    start in the same pixel, so an aggregate is at most about two pixels wide; wider ops are kept as they are. Levels
+    are added until merging no longer reduces the number of events by ``min_reduction`` or the resolution reaches
+    the microsecond resolution of the trace; below the finest level the events are returned as they are.
+
+    Args:
+        events (EventTable): the events of one lane with rows assigned, as returned by ``DataLoader.get_data``.
+        plot_width (int): width of the fully zoomed out plot in pixels. (default: 1200)
+        factor (int): zoom factor between consecutive levels. (default: 4)
+        min_reduction (float): minimum fraction of events a level must save over the raw events. (default: 0.5)
+    """
+    def __init__(self, events, plot_width=1200, factor=4, min_reduction=0.5):
+        self.events = events
+        start = np.asarray(events.start, dtype=np.float64)
+        end = np.asarray(events.end, dtype=np.float64)
+        self._raw = self._make_level(start, end, np.ones(len(start), dtype=np.int64), end - start,
+                                     np.arange(len(start)))
+        self.levels = []
+
+        span = end.max() - start.min() if len(start) > 0 else 0
+        if span <= 0:
+            return
+        order = np.lexsort((start, events.row))
+        resolution = span / plot_width
+        while resolution > TRACE_RESOLUTION:
+            level = self._merge(start[order], end[order], events.row[order], order, resolution)
+            if len(level["start"]) > (1 - min_reduction) * len(start):
+                break
+            self.levels.append((resolution, level))
+            resolution /= factor
+
+    @staticmethod
+    def _make_level(start, end, count, busy, index):
+        order = np.argsort(start, kind="stable")
+        return {
+            "start": start[order],
+            "end": end[order],
+            "count": count[order],
+            "busy": busy[order],
+            "index": index[order],
+            "max_length": float((end - start).max()) if len(start) > 0 else 0.0,
+        }
+
+    @classmethod
+    def _merge(cls, start, end, row, index, resolution):
+        # Ops are sorted by row and start, and do not overlap within a row.
+        wide = end - start >= resolution
+        pixel = np.floor(start / resolution)
+        first = np.ones(len(start), dtype=np.bool_)
+        first[1:] = wide[1:] | wide[:-1] | (row[1:] != row[:-1]) | (pixel[1:] != pixel[:-1])
+        firsts = np.flatnonzero(first)
+
+        duration = end - start
+        group = np.cumsum(first) - 1
+        # The longest op of each aggregate represents it (name, op, color).
+        longest = np.lexsort((-duration, group))[firsts]
+        return cls._make_level(
+            start[firsts],
+            np.maximum.reduceat(end, firsts),
+            np.diff(np.append(firsts, len(start))),
+            np.add.reduceat(duration, firsts),
+            index[longest],
+        )
+
+    def get_level(self, resolution):
+        """
+        Returns:
+            dict: the coarsest level that merges only ops narrower than ``resolution`` milliseconds.
+        """
+        for level_resolution, level in self.levels:
+            if level_resolution <= resolution:
+                return level
+        return self._raw
+
+    def query(self, start, end, resolution):
+        """
+        Selects the events overlapping a time window.
+
+        Args:
+            start (float): start of the window in milliseconds.
+            end (float): end of the window in milliseconds.
+            resolution (float): milliseconds per pixel.
+
+        Returns:
+            dict: arrays ``start``, ``end``, ``count`` (ops merged), ``busy`` (sum of the op durations) and ``index``
+            (of the op representing each event in ``events``).
+        """
+        level = self.get_level(resolution)
+        lo = np.searchsorted(level["start"], start - level["max_length"], side="left")
+        hi = np.searchsorted(level["start"], end, side="right")
+        selected = lo + np.flatnonzero(level["end"][lo:hi] >= start)
+        return {key: level[key][selected] for key in ("start", "end", "count", "busy", "index")}
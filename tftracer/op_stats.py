@@ -0,0 +1,385 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+"""
+Aggregate statistics of op durations over every trace of a run.
+
+Each trace updates, per op type and per node, a :class:`RunningStats` (count, mean and variance with the parallel
+form of Welford's algorithm) and a :class:`QuantileSketch` (a log-bucketed histogram with a bounded relative error).
+Both are updated from a whole trace at once and can be merged, so the raw traces need not be kept.
+"""
+from __future__ import division
+from __future__ import absolute_import
+
+import logging
+import math
+import queue
+import threading
+
+import numpy as np
+
+from .event_table import EventTable
+from .timeline_visualizer import parse_event_description
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+class RunningStats:
+    """
+    Count, total, mean, variance, min and max of a stream of values.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def add_many(self, values):
+        """Adds an array of values."""
+        if len(values) == 0:
+            return
+        mean = values.mean()
+        self.add_moments(len(values), float(values.sum()), float(((values - mean) ** 2).sum()), float(values.min()),
+                         float(values.max()))
+
+    def add_moments(self, count, total, m2, min_value, max_value):
+        """Adds a batch of values given by their count, sum, sum of squared deviations from their mean, min and max."""
+        if count == 0:
+            return
+        merged_count = self.count + count
+        delta = total / count - self.mean
+        self.mean += delta * count / merged_count
+        self.m2 += m2 + delta * delta * self.count * count / merged_count
+        self.count = merged_count
+        self.total += total
+        self.min = min(self.min, min_value)
+        self.max = max(self.max, max_value)
+
+    def merge(self, other):
+        """Adds the values of another ``RunningStats``."""
+        self.add_moments(other.count, other.total, other.m2, other.min, other.max)
+
+    def copy(self):
+        stats = RunningStats()
+        stats.__dict__.update(self.__dict__)
+        return stats
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+
+class QuantileSketch:
+    """
+    Estimates quantiles of non-negative values within a relative error of ``relative_accuracy``.
+
+    Value ``v > 0`` is counted in bucket ``ceil(log(v) / log(gamma))`` with ``gamma = (1 + a) / (1 - a)``; values
+    below ``min_value`` are counted apart. When there are more than ``max_buckets`` buckets, the lowest ones are
+    collapsed, which only affects the accuracy of the lowest quantiles.
+
+    Args:
+        relative_accuracy (float): (default: 0.01)
+        max_buckets (int): (default: 2048)
+        min_value (float): (default: 1e-3)
+    """
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048, min_value=1e-3):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.min_value = min_value
+        self._log_gamma = math.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def bucket_indices(self, values):
+        """Returns the bucket of every value above ``min_value``."""
+        return np.ceil(np.log(values) / self._log_gamma).astype(np.int64)
+
+    def add_buckets(self, indices, counts, zero_count=0):
+        """Adds pre-computed bucket counts, e.g. from :func:`bucket_indices`, given as lists."""
+        buckets = self.buckets
+        for index, count in zip(indices, counts):
+            buckets[index] = buckets.get(index, 0) + count
+        self.zero_count += zero_count
+        self.count += sum(counts) + zero_count
+        self._collapse()
+
+    def add_many(self, values):
+        """Adds an array of values."""
+        positive = values[values >= self.min_value]
+        indices, counts = np.unique(self.bucket_indices(positive), return_counts=True)
+        self.add_buckets(indices.tolist(), counts.tolist(), len(values) - len(positive))
+
+    def merge(self, other):
+        """Adds the values of another sketch with the same ``relative_accuracy``."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches of different accuracies.")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self._collapse()
+
+    def copy(self):
+        sketch = QuantileSketch(self.relative_accuracy, self.max_buckets, self.min_value)
+        sketch.buckets = dict(self.buckets)
+        sketch.zero_count = self.zero_count
+        sketch.count = self.count
+        return sketch
+
+    def _collapse(self):
+        if len(self.buckets) <= self.max_buckets:
+            return
+        indices = sorted(self.buckets)
+        collapsed = indices[:len(indices) - self.max_buckets + 1]
+        self.buckets[collapsed[-1]] = sum(self.buckets.pop(index) for index in collapsed[:-1]) + \
+            self.buckets[collapsed[-1]]
+
+    def quantile(self, q):
+        """
+        Returns:
+            float: the estimated ``q``-quantile, or None if no value was added.
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return self._bucket_value(index)
+        return self._bucket_value(max(self.buckets))
+
+    def _bucket_value(self, index):
+        # The middle of the bucket, in relative terms.
+        return 2 * math.exp(index * self._log_gamma) / (1 + math.exp(self._log_gamma))
+
+
+class OpStats:
+    """
+    Per op type and per node statistics of the op durations of the traces of a run, in microseconds.
+
+    Each ``NodeExecStats`` of a trace is one sample; a node that ran on several streams or devices in a step gives
+    several samples. ``add_trace`` may be called from several threads.
+
+    Args:
+        relative_accuracy (float): relative error of the quantiles. (default: 0.01)
+    """
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.traces = 0
+        self._by = {"op": {}, "node": {}}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        with self._lock:
+            state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add_trace(self, step_stats):
+        """
+        Adds the ops of a trace.
+
+        Args:
+            step_stats (tensorflow.StepStats): the trace.
+        """
+        events = EventTable.from_step_stats(step_stats)
+        if len(events) == 0:
+            return
+        durations = events.end_rel_micros.astype(np.float64)
+        op_codes, op_names = self._get_ops(events)
+        updates = [
+            ("op", op_names, self._group(op_codes, durations)),
+            ("node", events.name.categories, self._group(events.name.codes, durations)),
+        ]
+        with self._lock:
+            self.traces += 1
+            for kind, names, groups in updates:
+                aggregates = self._by[kind]
+                for code, moments, (indices, counts, zero_count) in groups:
+                    name = names[code]
+                    if name not in aggregates:
+                        aggregates[name] = (RunningStats(), QuantileSketch(self.relative_accuracy))
+                    stats, sketch = aggregates[name]
+                    stats.add_moments(*moments)
+                    sketch.add_buckets(indices, counts, zero_count)
+
+    @staticmethod
+    def _get_ops(events):
+        """
+        Returns:
+            tuple: (op code of each event, op names). As in ``DataLoader``, events whose label has no op (e.g.
+            ``RecvTensor`` or GPU kernels) fall back to their own node name.
+        """
+        ops = {}
+        description_op = np.full(len(events.description.categories), -1, dtype=np.int32)
+        for i, label in enumerate(events.description.categories):
+            _, op, _ = parse_event_description(label)
+            if op != "unknown":
+                description_op[i] = ops.setdefault(op, len(ops))
+
+        op_codes = description_op[events.description.codes]
+        unknown = op_codes < 0
+        if unknown.any():
+            name_op = np.full(len(events.name.categories), -1, dtype=np.int32)
+            for name_code in np.unique(events.name.codes[unknown]).tolist():
+                name_op[name_code] = ops.setdefault(events.name.categories[name_code], len(ops))
+            op_codes[unknown] = name_op[events.name.codes[unknown]]
+        return op_codes, list(ops)
+
+    def _group(self, codes, durations):
+        """
+        Computes the moments and the sketch buckets of the durations of each code with array operations, so the
+        per-group work left is a few scalar updates.
+
+        Returns:
+            list: ``(code, (count, total, m2, min, max), (bucket indices, bucket counts, zero count))`` per code.
+        """
+        order = np.argsort(codes, kind="stable")
+        codes, durations = codes[order], durations[order]
+        firsts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+        count = np.diff(np.append(firsts, len(codes)))
+        total = np.add.reduceat(durations, firsts)
+        m2 = np.add.reduceat((durations - np.repeat(total / count, count)) ** 2, firsts)
+        moments = zip(count.tolist(), total.tolist(), m2.tolist(), np.minimum.reduceat(durations, firsts).tolist(),
+                      np.maximum.reduceat(durations, firsts).tolist())
+
+        # Bucket counts of all groups at once, keyed by (group, bucket).
+        sketch = QuantileSketch(self.relative_accuracy)
+        positive = durations >= sketch.min_value
+        group = np.repeat(np.arange(len(firsts)), count)[positive]
+        buckets = sketch.bucket_indices(durations[positive])
+        zero_count = np.add.reduceat(~positive, firsts).tolist()
+        if len(buckets) > 0:
+            low = int(buckets.min())
+            width = int(buckets.max()) - low + 1
+            keys, bucket_counts = np.unique(group * width + (buckets - low), return_counts=True)
+            bounds = np.searchsorted(keys // width, np.arange(len(firsts) + 1)).tolist()
+            bucket_indices = (keys % width + low).tolist()
+            bucket_counts = bucket_counts.tolist()
+        else:
+            bounds = [0] * (len(firsts) + 1)
+            bucket_indices = bucket_counts = []
+
+        return [
+            (code, group_moments, (bucket_indices[start:end], bucket_counts[start:end], zeros))
+            for code, group_moments, start, end, zeros in zip(codes[firsts].tolist(), moments, bounds[:-1],
+                                                              bounds[1:], zero_count)
+        ]
+
+    def top(self, k=20, by="op", sort="total"):
+        """
+        Returns the most expensive op types or nodes.
+
+        Args:
+            k (int): number of entries. (default: 20)
+            by (str): "op" or "node". (default: "op")
+            sort (str): "total", "mean", "p99" or "count". (default: "total")
+
+        Returns:
+            list: dicts of ``name``, ``count``, ``total``, ``mean``, ``std``, ``min``, ``max``, ``p50`` and ``p99``,
+            durations in microseconds, sorted by ``sort`` in decreasing order.
+        """
+        if by not in self._by:
+            raise ValueError("Unknown grouping: {}".format(by))
+        if sort not in ("total", "mean", "p99", "count"):
+            raise ValueError("Unknown sort key: {}".format(sort))
+        # Quantiles are computed on a copy, so that add_trace does not wait for them.
+        with self._lock:
+            aggregates = [(name, stats.copy(), sketch) for name, (stats, sketch) in self._by[by].items()]
+            if sort == "p99":
+                aggregates = [(name, stats, sketch.copy()) for name, stats, sketch in aggregates]
+            else:
+                aggregates.sort(key=lambda aggregate: getattr(aggregate[1], sort), reverse=True)
+                aggregates = [(name, stats, sketch.copy()) for name, stats, sketch in aggregates[:k]]
+        entries = []
+        for name, stats, sketch in aggregates:
+            entries.append(dict(
+                name=name,
+                count=stats.count,
+                total=stats.total,
+                mean=stats.mean,
+                std=math.sqrt(stats.variance),
+                min=stats.min,
+                max=stats.max,
+                p50=sketch.quantile(0.5),
+                p99=sketch.quantile(0.99),
+            ))
+        entries.sort(key=lambda entry: entry[sort], reverse=True)
+        return entries[:k]
+
+    def merge(self, other):
+        """Adds the statistics of another ``OpStats``, e.g. of another run or process."""
+        with other._lock:
+            other_by = {kind: dict(aggregates) for kind, aggregates in other._by.items()}
+            other_traces = other.traces
+        with self._lock:
+            self.traces += other_traces
+            for kind, aggregates in other_by.items():
+                for name, (stats, sketch) in aggregates.items():
+                    if name not in self._by[kind]:
+                        self._by[kind][name] = (RunningStats(), QuantileSketch(self.relative_accuracy))
+                    self._by[kind][name][0].merge(stats)
+                    self._by[kind][name][1].merge(sketch)
+
+
+class OpStatsUpdater:
+    """
+    Adds traces to :class:`OpStats` from a background thread, so that capturing a trace does not wait for its
+    aggregation. :func:`submit` never blocks; when ``max_queue`` traces are already waiting, the trace is dropped
+    from the statistics and counted in ``dropped``.
+
+    Args:
+        max_queue (int): number of traces waiting to be added. (default: 16)
+    """
+    def __init__(self, max_queue=16):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self.dropped = 0
+
+    def submit(self, op_stats, run_metadata):
+        """
+        Queues ``op_stats.add_trace(run_metadata.step_stats)`` without blocking.
+        """
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="tftracer-op-stats")
+                self._thread.daemon = True
+                self._thread.start()
+        try:
+            self._queue.put_nowait((op_stats, run_metadata))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            op_stats, run_metadata = item
+            try:
+                op_stats.add_trace(run_metadata.step_stats)
+            except Exception as ex:
+                logging.getLogger("tensorflow").warning("Tracing Server: failed to update op statistics: {}".format(ex))
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """Waits until the queued traces are added."""
+        self._queue.join()
+
+    def close(self):
+        with self._thread_lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
@@ -0,0 +1,183 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+"""
+Overlap of communication and computation.
+
+Communication is hidden while other ops run at the same time; the rest of it is exposed, i.e. it delays the step.
+For each device (or host) and across all of them, :func:`analyze_overlap` computes the time covered by communication
+ops, by the other ops, by both (overlapped) and by communication alone (exposed), plus the same quantities over time
+bins of the step.
+
+Every function works on arrays of interval bounds with sorts, running maxima and cumulative sums only, so the cost is
+``O(n log n)`` for ``n`` intervals with no Python loop over the intervals.
+"""
+from __future__ import division
+from __future__ import absolute_import
+
+import numpy as np
+
+from .clock_alignment import get_host
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+def union_intervals(starts, ends, is_sorted=False):
+    """
+    Merges intervals into disjoint ones.
+
+    Args:
+        starts (numpy.ndarray): start of each interval.
+        ends (numpy.ndarray): end of each interval.
+        is_sorted (bool): whether ``starts`` is already sorted. (default: False)
+
+    Returns:
+        tuple: (starts, ends) of the disjoint intervals, sorted.
+    """
+    if not is_sorted:
+        order = np.argsort(starts, kind="stable")
+        starts, ends = starts[order], ends[order]
+    if len(starts) == 0:
+        return starts, ends
+    running_end = np.maximum.accumulate(ends)
+    first = np.ones(len(starts), dtype=np.bool_)
+    first[1:] = starts[1:] > running_end[:-1]
+    last = np.append(np.flatnonzero(first)[1:] - 1, len(starts) - 1)
+    return starts[first], running_end[last]
+
+
+def union_length(starts, ends, is_sorted=False):
+    """Total length of the union of the intervals."""
+    starts, ends = union_intervals(starts, ends, is_sorted)
+    return int((ends - starts).sum())
+
+
+def intersection_intervals(a_starts, a_ends, b_starts, b_ends):
+    """
+    Intersects two sets of disjoint intervals, e.g. as returned by :func:`union_intervals`.
+
+    Returns:
+        tuple: (starts, ends) of the disjoint intervals covered by both sets, sorted.
+    """
+    points = np.concatenate((a_starts, b_starts, a_ends, b_ends))
+    deltas = np.concatenate((np.ones(len(a_starts) + len(b_starts), dtype=np.int8),
+                             -np.ones(len(a_ends) + len(b_ends), dtype=np.int8)))
+    # At equal points, ends come first so touching intervals do not intersect.
+    order = np.lexsort((deltas, points))
+    points = points[order]
+    depth = np.cumsum(deltas[order])
+    both = np.flatnonzero(depth[:-1] == 2)
+    return points[both], points[both + 1]
+
+
+def covered_before(starts, ends, times):
+    """
+    Returns:
+        numpy.ndarray: for each of ``times``, the length of the disjoint, sorted intervals before it.
+    """
+    if len(starts) == 0:
+        return np.zeros(len(times), dtype=np.int64)
+    cumulative = np.concatenate(([0], np.cumsum(ends - starts)))
+    index = np.searchsorted(starts, times, side="right")
+    previous = np.maximum(index - 1, 0)
+    partial = np.where(index > 0, np.clip(times - starts[previous], 0, ends[previous] - starts[previous]), 0)
+    return cumulative[previous] * (index > 0) + partial
+
+
+def _overlap(starts, ends, is_comm):
+    communication = union_intervals(starts[is_comm], ends[is_comm], is_sorted=True)
+    computation = union_intervals(starts[~is_comm], ends[~is_comm], is_sorted=True)
+    overlapped = intersection_intervals(communication[0], communication[1], computation[0], computation[1])
+    return communication, computation, overlapped
+
+
+def _lengths(communication, computation, overlapped):
+    communication_time, computation_time, overlapped_time = (
+        int((intervals[1] - intervals[0]).sum()) for intervals in (communication, computation, overlapped))
+    return dict(
+        communication_time=communication_time,
+        computation_time=computation_time,
+        overlapped_time=overlapped_time,
+        exposed_time=communication_time - overlapped_time,
+    )
+
+
+def overlap_times(starts, ends, is_comm):
+    """
+    Args:
+        starts (numpy.ndarray): start of each op, sorted.
+        ends (numpy.ndarray): end of each op.
+        is_comm (numpy.ndarray): whether each op is a communication op.
+
+    Returns:
+        dict: ``communication_time``, ``computation_time`` (of the other ops), ``overlapped_time`` and
+        ``exposed_time``.
+    """
+    return _lengths(*_overlap(starts, ends, is_comm))
+
+
+def analyze_overlap(starts, ends, is_comm, groups, group_names, bins=100):
+    """
+    Computes the overlap of communication and computation per group of devices and across all of them.
+
+    Args:
+        starts (numpy.ndarray): start of each op in microseconds.
+        ends (numpy.ndarray): end of each op in microseconds.
+        is_comm (numpy.ndarray): whether each op is a communication op.
+        groups (numpy.ndarray): the group (e.g. device) of each op, as an index into ``group_names``.
+        group_names (list): the name of each group.
+        bins (int): number of time bins of the profile. (default: 100)
+
+    Returns:
+        dict: ``communication_time``, ``computation_time`` (of the other ops), ``overlapped_time`` and
+        ``exposed_time`` across all groups, in microseconds; ``groups``, the same metrics by group name; and
+        ``profile``, the same metrics per time bin as arrays, with the bin ``edges`` relative to the first op.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    is_comm = np.asarray(is_comm, dtype=np.bool_)
+    groups = np.asarray(groups)
+
+    order = np.argsort(starts, kind="stable")
+    intervals = _overlap(starts[order], ends[order], is_comm[order])
+    result = _lengths(*intervals)
+
+    # One sort by (group, start) for all the groups.
+    order = np.lexsort((starts, groups))
+    bounds = np.searchsorted(groups[order], np.arange(len(group_names) + 1))
+    result["groups"] = {}
+    for group, name in enumerate(group_names):
+        selected = order[bounds[group]:bounds[group + 1]]
+        if len(selected) > 0:
+            result["groups"][name] = overlap_times(starts[selected], ends[selected], is_comm[selected])
+
+    begin = int(starts.min()) if len(starts) > 0 else 0
+    end = int(ends.max()) if len(starts) > 0 else 0
+    edges = np.linspace(begin, end, bins + 1)
+    profile = {"edges": edges - begin}
+    for metric, (interval_starts, interval_ends) in zip(("communication_time", "computation_time",
+                                                         "overlapped_time"), intervals):
+        profile[metric] = np.diff(covered_before(interval_starts, interval_ends, edges))
+    profile["exposed_time"] = profile["communication_time"] - profile["overlapped_time"]
+    result["profile"] = profile
+    return result
+
+
+def get_groups(devices, device, by="device"):
+    """
+    Args:
+        devices (list): device names.
+        device (numpy.ndarray): the device of each op, as an index into ``devices``.
+        by (str): "device", or "host" to combine the devices of a host, see
+            :func:`tftracer.clock_alignment.get_host`.
+
+    Returns:
+        tuple: (groups, group_names) for :func:`analyze_overlap`.
+    """
+    if by == "device":
+        return device, list(devices)
+    elif by == "host":
+        host_index = {}
+        mapping = np.array([host_index.setdefault(get_host(name), len(host_index)) for name in devices],
+                           dtype=np.int32)
+        return (mapping[device] if len(mapping) > 0 else device), list(host_index)
+    raise ValueError("Unknown grouping: {}".format(by))
@@ -8,4 +8,21 @@ elems.each(function (i) {
         $("#xl-toolbox").html(content);
     }
 });
-UIkit.modal('#modal-details').show();
\ No newline at end of file
+
+let show_details = function (details) {
+    $("#xl-toolbox").append($("<pre class='xl-box'></pre>").text(details));
+};
+let source = cb_data.source;
+let index = source.selected.indices[0];
+if (index !== undefined) {
+    if (source.data.details !== undefined) {
+        show_details(source.data.details[index]);
+    } else if (details_url) {
+        fetch(details_url + source.data.event_idx[index])
+            .then(function (response) {
+                return response.text();
+            })
+            .then(show_details);
+    }
+}
+UIkit.modal('#modal-details').show();
@@ -0,0 +1,23 @@
+// Fetches the events of the visible range, at the current zoom level, once the user stops zooming or panning.
+window.xl_tiles = window.xl_tiles || {};
+let state = window.xl_tiles[lane] = window.xl_tiles[lane] || {timer: null, request: 0};
+clearTimeout(state.timer);
+state.timer = setTimeout(function () {
+    let start = plot.x_range.start;
+    let end = plot.x_range.end;
+    let width = end - start;
+    let resolution = width / Math.max(plot.inner_width || plot.plot_width, 1);
+    let request = ++state.request;
+    // One extra screen on each side, so short pans do not show empty space.
+    fetch(tiles_url + "lane=" + lane + "&start=" + (start - width) + "&end=" + (end + width) +
+        "&resolution=" + resolution)
+        .then(function (response) {
+            return response.json();
+        })
+        .then(function (data) {
+            if (request === state.request) {
+                source.data = data;
+                source.change.emit();
+            }
+        });
+}, 150);
@@ -35,20 +35,38 @@ var app = new Vue({
         updating: false,
         global_tracing: false,
         runs: [],
+        session: "",
+        revision: 0,
+        etag: null,
         connection_error: false
     },
     methods: {
         update_data: function () {
             this.updating = true;
-            fetch("/update")
+            var url = "/update?since=" + this.revision + "&session=" + this.session;
+            var headers = this.etag ? {"If-None-Match": this.etag} : {};
+            fetch(url, {headers: headers, cache: "no-store"})
                 .then(function (response) {
+                    if (response.status === 304) {
+                        return null;
+                    }
+                    app.etag = response.headers.get("ETag");
                     return response.json();
                 })
                 .then(function (data) {
                     app.connection_error = false;
-                    app.running = data.running;
-                    app.global_tracing = data.global_tracing;
-                    app.runs = data.runs;
+                    if (data !== null) {
+                        app.running = data.running;
+                        app.global_tracing = data.global_tracing;
+                        if (data.full) {
+                            app.runs = [];
+                        }
+                        data.runs.forEach(function (run) {
+                            Vue.set(app.runs, run.run_id, run);
+                        });
+                        app.session = data.session;
+                        app.revision = data.revision;
+                    }
                     setTimeout(function () {
                         app.updating = false;
                     }, 1000);
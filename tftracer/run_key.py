@@ -0,0 +1,37 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import six
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+def fingerprint(value):
+    """
+    A cheap stand-in for ``repr`` of fetches and feeds: tensors, operations and variables are identified by their
+    names and containers by their structure. Values are never converted to strings.
+    """
+    if value is None or isinstance(value, six.string_types):
+        return value
+    name = getattr(value, "name", None)
+    if isinstance(name, six.string_types):
+        return name
+    if isinstance(value, dict):
+        return tuple((fingerprint(key), fingerprint(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(fingerprint(item) for item in value)
+    return type(value).__name__
+
+
+def get_run_key(args):
+    """
+    Returns:
+        tuple: a key identifying a run by the names of its fetches, the names of its feeds and its options.
+
+    Args:
+        args (tf.train.SessionRunArgs): the original arguments of the run.
+    """
+    return (
+        fingerprint(args.fetches),
+        tuple(fingerprint(feed) for feed in args.feed_dict) if args.feed_dict else None,
+        args.options.SerializeToString() if args.options is not None else None,
+    )
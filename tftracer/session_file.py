@@ -0,0 +1,242 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+"""
+The tftracer session file format.
+
+A session file is a header followed by records and, when the file was closed properly, an index:
+
+    header:  MAGIC, version (uint32)
+    record:  type (uint8), run_id (uint32), trace_id (uint32), length (uint32), raw length (uint32), crc32 (uint32),
+             followed by ``length`` bytes of zlib-compressed payload
+    trailer: offset of the index record (uint64), MAGIC
+
+Trace records hold a serialized ``RunMetadata``, the runs record holds the run profiles as JSON and the index record
+holds the offsets of the other records as JSON. Readers memory-map the file and decompress only the records they
+need. A file without a valid trailer (e.g. an interrupted log) is recovered by scanning the records in order.
+"""
+import datetime
+import json
+import mmap
+import struct
+import zlib
+
+__author__ = 'Sayed Hadi Hashemi'
+
+MAGIC = b"TFTRSESS"
+VERSION = 1
+
+RECORD_TRACE = 1
+RECORD_RUNS = 2
+RECORD_INDEX = 3
+
+_HEADER = struct.Struct("<8sI")
+_RECORD = struct.Struct("<BIIIII")
+_TRAILER = struct.Struct("<Q8s")
+
+
+def is_session_file(filename):
+    """
+    Returns:
+        bool: whether the file starts with the session file header.
+    """
+    with open(filename, "rb") as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+
+def encode_profile(profile):
+    """Converts a run profile of ``TracingSource`` to JSON-compatible types."""
+    stats = profile["stats"]
+    return {
+        "info": profile["info"],
+        "stats": {
+            "runs": stats["runs"],
+            "traces": stats["traces"],
+            "runtimes": stats["runtimes"].total_seconds(),
+            "first_run": stats["first_run"].isoformat(),
+            "last_run": stats["last_run"].isoformat(),
+        },
+        "traces": [{"trace_id": trace["trace_id"], "date": trace["date"].isoformat()} for trace in profile["traces"]],
+        "key": repr(profile["key"]),
+        "run_id": profile["run_id"],
+    }
+
+
+def decode_profile(data):
+    """The inverse of :func:`encode_profile`. The loaded runs are not being traced."""
+    def to_datetime(value):
+        return datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f" if "." in value else "%Y-%m-%dT%H:%M:%S")
+
+    stats = data["stats"]
+    return {
+        "info": data["info"],
+        "stats": {
+            "runs": stats["runs"],
+            "traces": stats["traces"],
+            "runtimes": datetime.timedelta(seconds=stats["runtimes"]),
+            "first_run": to_datetime(stats["first_run"]),
+            "last_run": to_datetime(stats["last_run"]),
+        },
+        "traces": [{"trace_id": trace["trace_id"], "date": to_datetime(trace["date"])} for trace in data["traces"]],
+        "key": data["key"],
+        "run_id": data["run_id"],
+        "next_trace_id": max([trace["trace_id"] + 1 for trace in data["traces"]] or [0]),
+        "tracing": False,
+        "burst": None,
+        "revision": 1,
+    }
+
+
+class SessionWriter:
+    """
+    Writes a session file to a binary file object. Records are written as they are added; :func:`close` writes the
+    index.
+
+    Args:
+        fp: a binary file object open for writing.
+        compression_level (int): zlib compression level. (default: 6)
+    """
+    def __init__(self, fp, compression_level=6):
+        self._fp = fp
+        self._compression_level = compression_level
+        self._offset = 0
+        self._traces = []
+        self._runs_offset = None
+        self._write(_HEADER.pack(MAGIC, VERSION))
+
+    def _write(self, data):
+        self._fp.write(data)
+        self._offset += len(data)
+
+    def _write_record(self, record_type, run_id, trace_id, data):
+        offset = self._offset
+        payload = zlib.compress(data, self._compression_level)
+        self._write(_RECORD.pack(record_type, run_id, trace_id, len(payload), len(data), zlib.crc32(payload)))
+        self._write(payload)
+        return offset
+
+    def write_trace(self, run_id, trace_id, data):
+        """Adds a serialized ``RunMetadata``."""
+        offset = self._write_record(RECORD_TRACE, run_id, trace_id, data)
+        self._traces.append([run_id, trace_id, offset])
+
+    def write_runs(self, runs):
+        """Adds the run profiles. If called more than once, the last one is used."""
+        self._runs_offset = self._write_record(RECORD_RUNS, 0, 0, json.dumps(runs).encode("utf-8"))
+
+    def flush(self):
+        self._fp.flush()
+
+    def close(self):
+        """Writes the index. The underlying file object is not closed."""
+        index = {"runs": self._runs_offset, "traces": self._traces}
+        offset = self._write_record(RECORD_INDEX, 0, 0, json.dumps(index).encode("utf-8"))
+        self._write(_TRAILER.pack(offset, MAGIC))
+        self.flush()
+
+
+class SessionFile:
+    """
+    A memory-mapped, read-only session file.
+
+    Raises:
+        ValueError: if the file is not a session file of a supported version.
+    """
+    def __init__(self, filename):
+        self._filename = filename
+        self._file = open(filename, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError("Not a tftracer session file: {}".format(filename))
+        if len(self._mmap) < _HEADER.size:
+            raise ValueError("Not a tftracer session file: {}".format(filename))
+        magic, version = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a tftracer session file: {}".format(filename))
+        if version > VERSION:
+            raise ValueError("Unsupported session file version: {}".format(version))
+
+        self._traces = {}
+        self._runs_offset = None
+        self.recovered = not self._read_index()
+        if self.recovered:
+            self._scan()
+
+    def __getstate__(self):
+        return {"filename": self._filename}
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def __setstate__(self, state):
+        self.__init__(state["filename"])
+
+    def _read_record(self, offset):
+        if offset + _RECORD.size > len(self._mmap):
+            return None
+        record_type, run_id, trace_id, length, raw_length, crc = _RECORD.unpack_from(self._mmap, offset)
+        start = offset + _RECORD.size
+        payload = self._mmap[start:start + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            return None
+        return record_type, run_id, trace_id, payload, start + length
+
+    def _read_index(self):
+        if len(self._mmap) < _HEADER.size + _TRAILER.size:
+            return False
+        offset, magic = _TRAILER.unpack_from(self._mmap, len(self._mmap) - _TRAILER.size)
+        if magic != MAGIC:
+            return False
+        record = self._read_record(offset)
+        if record is None or record[0] != RECORD_INDEX:
+            return False
+        index = json.loads(zlib.decompress(record[3]).decode("utf-8"))
+        self._runs_offset = index["runs"]
+        self._traces = {(run_id, trace_id): offset for run_id, trace_id, offset in index["traces"]}
+        return True
+
+    def _scan(self):
+        offset = _HEADER.size
+        while True:
+            record = self._read_record(offset)
+            if record is None:
+                break
+            record_type, run_id, trace_id, _, next_offset = record
+            if record_type == RECORD_TRACE:
+                self._traces[(run_id, trace_id)] = offset
+            elif record_type == RECORD_RUNS:
+                self._runs_offset = offset
+            offset = next_offset
+
+    def get_runs(self):
+        """
+        Returns:
+            the last runs record, or None if there is none.
+        """
+        if self._runs_offset is None:
+            return None
+        record = self._read_record(self._runs_offset)
+        return json.loads(zlib.decompress(record[3]).decode("utf-8"))
+
+    def trace_keys(self):
+        """
+        Returns:
+            list: ``(run_id, trace_id)`` of the traces in the file.
+        """
+        return sorted(self._traces)
+
+    def get_trace_bytes(self, key):
+        """
+        Returns:
+            bytes: the serialized ``RunMetadata`` of a trace, or None if the file does not have it.
+        """
+        if key not in self._traces:
+            return None
+        record = self._read_record(self._traces[key])
+        return zlib.decompress(record[3])
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
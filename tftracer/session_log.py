@@ -0,0 +1,160 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from .session_file import SessionWriter
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+class SessionLog:
+    """
+    Appends traces to a session file from a background thread as they are captured, so a session survives the
+    process. A log that was not closed (e.g. the job was killed) is still readable; see
+    :class:`tftracer.session_file.SessionFile`.
+
+    :func:`submit` never blocks. When the queue is full, the trace is either dropped or, with the "defer" overflow
+    policy, remembered by key and read back from the source's trace store once the writer catches up.
+
+    The run profiles are rewritten at most every ``runs_interval`` seconds and on :func:`close`, since each copy holds
+    the whole run table. Traces written after the last copy are still recovered, see
+    :func:`TracingSource.from_session_file`.
+
+    Args:
+        filename (str): path to the session file. An existing file is overwritten.
+        source (TracingSource): where the run profiles and deferred traces are read from.
+        max_queue (int): number of traces waiting to be written. (default: 64)
+        overflow (str): "drop" or "defer". (default: "drop")
+        runs_interval (float): minimum number of seconds between two copies of the run profiles. (default: 10)
+        close_timeout (float): seconds :func:`close` waits for the writer to finish the queued traces. (default: 30)
+    """
+    overflow_policies = ("drop", "defer")
+
+    def __init__(self, filename, source, max_queue=64, overflow="drop", runs_interval=10, close_timeout=30):
+        if overflow not in self.overflow_policies:
+            raise ValueError("Unknown overflow policy: {}".format(overflow))
+        self._source = source
+        self._overflow = overflow
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._deferred = OrderedDict()
+        self._deferred_lock = threading.Lock()
+        self._fp = open(filename, "wb")
+        self._writer = SessionWriter(self._fp)
+        self._closed = False
+        self._runs_interval = runs_interval
+        self._runs_written = None
+        self._runs_pending = False
+        self._close_timeout = close_timeout
+        self.written = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="tftracer-session-log")
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, run_id, trace_id, run_metadata):
+        """
+        Queues a trace for writing without blocking.
+        """
+        try:
+            self._queue.put_nowait((run_id, trace_id, run_metadata))
+        except queue.Full:
+            if self._overflow == "defer":
+                with self._deferred_lock:
+                    self._deferred[(run_id, trace_id)] = None
+            else:
+                self.dropped += 1
+
+    def _next(self):
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        with self._deferred_lock:
+            if self._deferred:
+                run_id, trace_id = self._deferred.popitem(last=False)[0]
+                return run_id, trace_id, None
+        try:
+            return self._queue.get(timeout=1)
+        except queue.Empty:
+            return False
+
+    def _run(self):
+        while True:
+            item = self._next()
+            if item is None:
+                break
+            try:
+                self._write(item)
+            except Exception as e:
+                # Keep the writer alive; a failed trace is counted as dropped.
+                if item is not False:
+                    self.dropped += 1
+                logging.getLogger("tensorflow").warning("Tracing Session Log: failed to write: {}".format(e))
+
+    def _write(self, item):
+        if item is False:
+            self._write_runs()
+            return
+        run_id, trace_id, run_metadata = item
+        if run_metadata is not None:
+            data = run_metadata.SerializeToString()
+        else:
+            data = self._source.get_trace_bytes(run_id, trace_id)
+        if data is None:
+            # discarded before it could be written
+            self.dropped += 1
+            return
+        self._writer.write_trace(run_id, trace_id, data)
+        self._writer.flush()
+        self.written += 1
+        self._runs_pending = True
+        self._write_runs()
+
+    def _write_runs(self):
+        now = time.time()
+        if not self._runs_pending or (self._runs_written is not None and
+                                      now - self._runs_written < self._runs_interval):
+            return
+        self._writer.write_runs(self._source.get_session_state())
+        self._writer.flush()
+        os.fsync(self._fp.fileno())
+        self._runs_written = now
+        self._runs_pending = False
+
+    def close(self):
+        """
+        Writes the pending traces and the index, then closes the file. If the writer does not finish within
+        ``close_timeout`` seconds, the file is left as is; it is still readable as a log that was not closed.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=self._close_timeout)
+                self._thread.join(self._close_timeout)
+            except queue.Full:
+                pass
+            if self._thread.is_alive():
+                logging.getLogger("tensorflow").warning(
+                    "Tracing Session Log: writer did not finish in {} seconds; {} is not closed".format(
+                        self._close_timeout, self._fp.name))
+                return
+        with self._deferred_lock:
+            deferred = list(self._deferred)
+            self._deferred.clear()
+        for run_id, trace_id in deferred:
+            data = self._source.get_trace_bytes(run_id, trace_id)
+            if data is not None:
+                self._writer.write_trace(run_id, trace_id, data)
+                self.written += 1
+        self._writer.write_runs(self._source.get_session_state())
+        self._writer.close()
+        self._fp.close()
@@ -3,12 +3,18 @@
 from __future__ import absolute_import
 from __future__ import with_statement
 
-import math
+import gzip
 import pickle
 import time
 from io import open
+
+import numpy as np
+from .chrome_trace import write_chrome_trace
+from .clock_alignment import estimate_clock_offsets, get_device_offsets
+from .critical_path import analyze_critical_path
+from .event_table import EventTable
+from .overlap import analyze_overlap, get_groups, overlap_times, union_length
 from .timeline_visualizer import DataLoader, TimelineVisualizer
-import tensorflow
 __author__ = 'Sayed Hadi Hashemi'
 
 
@@ -25,25 +31,33 @@ class Timeline(object):
 
     Args:
         run_metadata (tensorflow.RunMetadata): If set a web server starts on object initialization. (default: true)
+        clock_offsets (dict or str): clock offsets in microseconds, by host or device name, added to the timestamps
+        of traces combined from several hosts. "auto" estimates them from the trace,
+        see :func:`tftracer.Timeline.estimate_clock_offsets`. (default: None)
     """
     def __init__(self, run_metadata=None, **kwargs):
         self._elapsed = 0
         self._run_metadata = run_metadata
+        self._event_table = None
+        self._intervals = {}
+        self._summaries = {}
         self._options = None
+        self._clock_offsets = kwargs.get("clock_offsets", None)
+        self._resolved_clock_offsets = None
+        self._critical_path = None
         comm_op_name = kwargs.get("comm_op_name", None)
         self._comm_op_name = comm_op_name if comm_op_name is not None else "RecvTensor"
 
-    def __is_communication_op(self, op):
-        if " = HorovodAllreduce(" in op.timeline_label:
-            return True
-        else:
-            return op.node_name == self._comm_op_name
-
     def __enter__(self):
         from tensorflow import RunMetadata, RunOptions
 
         self.__start = time.time()
         self._run_metadata = RunMetadata()
+        self._event_table = None
+        self._resolved_clock_offsets = None
+        self._critical_path = None
+        self._intervals = {}
+        self._summaries = {}
         self._options = RunOptions(trace_level=RunOptions.FULL_TRACE, output_partition_graphs=True)
 
         return self
@@ -64,22 +78,176 @@ class Timeline(object):
             raise Exception("TensorFlow is not found")
         return dict(run_metadata=self._run_metadata, options=self._options)
 
-    def visualize(self, output_file=None, device_pattern=None):
+    def visualize(self, output_file=None, device_pattern=None, embed_details=False, details_url=None,
+                  resources_url=None, single_canvas=False, critical_path=False):
         """
         Visualizes the runtime_metadata and saves it as a HTML file.
         Args:
             output_file (str): the output file path. If is None, returns the HTML content instead.
             device_pattern (str): a regex pattern used to choose which device to be included.
             If None, all devices are used.
+            embed_details (bool): if set, the full ``NodeExecStats`` of every op is embedded in the HTML and shown
+            when an op is clicked. This noticeably increases the file size. (default: False)
+            details_url (str): the URL prefix from which the page fetches the details of a clicked op on demand.
+            resources_url (str): the URL prefix from which the page loads the Bokeh JS/CSS. If None, they are
+            inlined, so the file works offline.
+            single_canvas (bool): if set, all devices are drawn into one figure instead of one figure per device,
+            which loads much faster when there are many devices. (default: False)
+            critical_path (bool): if set, the ops of the critical path are outlined and the slack of every op is
+            shown in its tooltip, see :func:`critical_path`. (default: False)
 
         Returns:
             str: If output_file is None returns the HTML content, otherwise returns None.
 
         """
-        data_loader = DataLoader(self._run_metadata, device_pattern)
-        visualizer = TimelineVisualizer(data_loader)
+        data_loader = DataLoader(self._run_metadata, device_pattern, self._get_clock_offsets(),
+                                 critical_path=critical_path)
+        visualizer = TimelineVisualizer(data_loader, details_url=details_url, embed_details=embed_details,
+                                        resources_url=resources_url, single_canvas=single_canvas)
         return visualizer.visualize(output_file)
 
+    def _get_event_table(self):
+        if self._event_table is None:
+            table = EventTable.from_step_stats(self._run_metadata.step_stats, comm_op_name=self._comm_op_name)
+            clock_offsets = self._get_clock_offsets(table)
+            if clock_offsets:
+                table.shift(get_device_offsets(table.devices, clock_offsets))
+            self._event_table = table
+        return self._event_table
+
+    def _get_clock_offsets(self, table=None):
+        if self._clock_offsets != "auto":
+            return self._clock_offsets
+        if self._resolved_clock_offsets is None:
+            if table is None:
+                table = EventTable.from_step_stats(self._run_metadata.step_stats, comm_op_name=self._comm_op_name)
+            self._resolved_clock_offsets = estimate_clock_offsets(table)
+        return self._resolved_clock_offsets
+
+    def estimate_clock_offsets(self):
+        """
+        Estimates the clock offset of each host relative to the first one, from the end times of
+        ``HorovodAllreduce`` ops and from matching ``_Send``/``_Recv`` ops across hosts.
+        The host of a device is its name up to ``/device:``.
+
+        Returns:
+            dict: offset in microseconds by host.
+        """
+        return estimate_clock_offsets(
+            EventTable.from_step_stats(self._run_metadata.step_stats, comm_op_name=self._comm_op_name))
+
+    def _get_intervals(self, device_search_pattern):
+        """
+        Returns the ops of the matching devices sorted by start time. The result is memoized per pattern.
+        """
+        device_search = "" if device_search_pattern is None else device_search_pattern
+        if device_search not in self._intervals:
+            table = self._get_event_table()
+            indices = np.flatnonzero(table.device_mask(device_search))
+            indices = indices[np.argsort(table.start_micros[indices], kind="stable")]
+            self._intervals[device_search] = table.take(indices)
+        return self._intervals[device_search]
+
+    @staticmethod
+    def _elapsed_time(starts, ends):
+        return int(ends.max() - starts.min()) if len(starts) > 0 else 0
+
+    def summary(self, device_search_pattern=None, exclude_pattern=None):
+        """
+        Calculates all the timeline metrics at once.
+        Args:
+            device_search_pattern (str): a pattern used to choose which device to be included.
+            If None, all devices are used.
+            exclude_pattern (str): ops whose description contains this pattern are excluded from the computation and
+            communication metrics.
+
+        Returns:
+            dict: ``step_time``, ``computation_time``, ``communication_time``, ``communication_elapsed_time``,
+            ``communication_overlap_time``, the time communication ran alongside other ops, and
+            ``communication_exposed_time``, the time only communication ran. See :func:`overlap` for a breakdown by
+            device.
+
+        """
+        key = (device_search_pattern, exclude_pattern)
+        if key in self._summaries:
+            return dict(self._summaries[key])
+
+        ops = self._get_intervals(device_search_pattern)
+        starts, ends = ops.start_micros, ops.end_micros
+        included = np.ones(len(ops), dtype=np.bool_)
+        if exclude_pattern is not None:
+            included = ~ops.description_mask(exclude_pattern)
+        communication = included & ops.is_comm
+        times = overlap_times(starts[included], ends[included], ops.is_comm[included])
+        self._summaries[key] = dict(
+            step_time=self._elapsed_time(starts, ends),
+            computation_time=union_length(starts[included], ends[included], is_sorted=True),
+            communication_time=times["communication_time"],
+            communication_elapsed_time=self._elapsed_time(starts[communication], ends[communication]),
+            communication_overlap_time=times["overlapped_time"],
+            communication_exposed_time=times["exposed_time"],
+        )
+        return dict(self._summaries[key])
+
+    def overlap(self, device_search_pattern=None, exclude_pattern=None, bins=100, by="device"):
+        """
+        Breaks down how much communication is hidden behind the other ops, per device and across devices.
+
+        Across devices, communication on one device counts as overlapped while another device computes; per device,
+        only the ops of the same device count. Horovod runs its communication on the CPU device, so ``by="host"``
+        is usually more telling for it.
+
+        Args:
+            device_search_pattern (str): a pattern used to choose which device to be included.
+            If None, all devices are used.
+            exclude_pattern (str): ops whose description contains this pattern are excluded.
+            bins (int): number of time bins of the profile. (default: 100)
+            by (str): "device" or "host". (default: "device")
+
+        Returns:
+            dict: ``communication_time``, ``computation_time`` (of the other ops), ``overlapped_time`` and
+            ``exposed_time`` in microseconds; ``groups``, the same by device or host name; ``profile``, the same per
+            time bin as arrays, with the bin ``edges`` in microseconds from the start of the step.
+        """
+        ops = self._get_intervals(device_search_pattern)
+        included = np.ones(len(ops), dtype=np.bool_)
+        if exclude_pattern is not None:
+            included = ~ops.description_mask(exclude_pattern)
+        groups, group_names = get_groups(ops.devices, ops.device[included], by)
+        return analyze_overlap(ops.start_micros[included], ops.end_micros[included], ops.is_comm[included], groups,
+                               group_names, bins)
+
+    def to_chrome_trace(self, output_file, device_pattern=None):
+        """
+        Saves the timeline in the Chrome trace-event JSON format, which ``chrome://tracing`` and
+        `Perfetto <https://ui.perfetto.dev>`_ open. Unlike :func:`visualize`, this scales to millions of ops.
+        The file is written incrementally and is gzip-compressed if its name ends with ".gz".
+
+        Args:
+            output_file (str): the output file path.
+            device_pattern (str): a regex pattern used to choose which device to be included.
+            If None, all devices are used.
+        """
+        data_loader = DataLoader(self._run_metadata, device_pattern, self._get_clock_offsets())
+        opener = gzip.open if output_file.endswith(".gz") else open
+        with opener(output_file, "wt") as fp:
+            write_chrome_trace(fp, data_loader)
+
+    def critical_path(self):
+        """
+        Finds the ops that bound the step: the critical path, and the slack of every op, i.e. how much later it
+        could have finished without delaying the step. Dependencies are taken from the partition graphs, which
+        ``Timeline.kwargs`` requests.
+
+        Returns:
+            dict: ``path``, the ops of the critical path in execution order as dicts of name, device, start and end in
+            microseconds; ``length``, the duration of the path in microseconds; ``slack``, the slack of every op in
+            microseconds by node name.
+        """
+        if self._critical_path is None:
+            self._critical_path = analyze_critical_path(self._run_metadata)
+        return self._critical_path
+
     def step_time(self, device_search_pattern=None):
         """
         Calculate the step time.
@@ -91,72 +259,17 @@ class Timeline(object):
             float: the time in seconds.
 
         """
-        max_time = 0
-        min_time = math.inf
-        device_search = "" if device_search_pattern is None else device_search_pattern
-        all_ops = []
-        for device in [d for d in self._run_metadata.step_stats.dev_stats if device_search in d.device]:
-            all_ops += device.node_stats
-        for op in sorted(all_ops, key=lambda a: a.all_start_micros):
-            min_time = min(min_time, op.all_start_micros)
-            max_time = max(max_time, op.all_start_micros + op.all_end_rel_micros)
-        return max_time - min_time if min_time != math.inf else 0
+        ops = self._get_intervals(device_search_pattern)
+        return self._elapsed_time(ops.start_micros, ops.end_micros)
 
     def communication_elapsed_time(self, device_search_pattern=None, exclude_pattern=None):
-        max_time = 0
-        min_time = math.inf
-        device_search = "" if device_search_pattern is None else device_search_pattern
-        all_ops = []
-        for device in [d for d in self._run_metadata.step_stats.dev_stats if device_search in d.device]:
-            all_ops += device.node_stats
-        for op in sorted(all_ops, key=lambda a: a.all_start_micros):
-            if not self.__is_communication_op(op):
-                continue
-            if exclude_pattern is not None and exclude_pattern in op.timeline_label:
-                continue
-            min_time = min(min_time, op.all_start_micros)
-            max_time = max(max_time, op.all_start_micros + op.all_end_rel_micros)
-        return max_time - min_time if min_time != math.inf else 0
+        return self.summary(device_search_pattern, exclude_pattern)["communication_elapsed_time"]
 
     def communication_time(self, device_search_pattern=None, exclude_pattern=None):
-        device_search = "" if device_search_pattern is None else device_search_pattern
-        all_ops = []
-        for device in [d for d in self._run_metadata.step_stats.dev_stats if device_search in d.device]:
-            all_ops += device.node_stats
-
-        last_ = -math.inf
-        total = 0
-        for op in sorted(all_ops, key=lambda a: a.all_start_micros):
-            if not self.__is_communication_op(op):
-                continue
-            if exclude_pattern is not None and exclude_pattern in op.timeline_label:
-                continue
-            if op.all_start_micros > last_:
-                total += op.all_end_rel_micros
-            elif op.all_start_micros + op.all_end_rel_micros > last_:
-                total += op.all_start_micros + op.all_end_rel_micros - last_
-            last_ = max(last_, op.all_start_micros + op.all_end_rel_micros)
-
-        return total
+        return self.summary(device_search_pattern, exclude_pattern)["communication_time"]
 
     def computation_time(self, device_search_pattern=None, exclude_pattern=None):
-        device_search = "" if device_search_pattern is None else device_search_pattern
-        all_ops = []
-        for device in [d for d in self._run_metadata.step_stats.dev_stats if device_search in d.device]:
-            all_ops += device.node_stats
-
-        last_ = -math.inf
-        total = 0
-        for op in sorted(all_ops, key=lambda a: a.all_start_micros):
-            if exclude_pattern is not None and exclude_pattern in op.timeline_label:
-                continue
-            if op.all_start_micros > last_:
-                total += op.all_end_rel_micros
-            elif op.all_start_micros + op.all_end_rel_micros > last_:
-                total += op.all_start_micros + op.all_end_rel_micros - last_
-            last_ = max(last_, op.all_start_micros + op.all_end_rel_micros)
-
-        return total
+        return self.summary(device_search_pattern, exclude_pattern)["computation_time"]
 
     @property
     def wall_clock_elapsed(self):
@@ -5,47 +5,88 @@ from __future__ import unicode_literals
 from __future__ import with_statement
 from __future__ import absolute_import
 from io import open
+import itertools
 import os
 import random
 import re
 from datetime import datetime
+from functools import lru_cache
 
+import numpy as np
 import six
 from bokeh.embed import components
 from bokeh.layouts import gridplot
 from bokeh.models import ColumnDataSource, Range1d, SingleIntervalTicker, WidgetBox, \
-    HoverTool, CustomJS, Button, TapTool
+    HoverTool, CustomJS, Button, TapTool, BoxAnnotation, FixedTicker
 from bokeh.plotting import figure
-from bokeh.resources import INLINE
+from bokeh.resources import INLINE, Resources
 from bokeh.util.string import encode_utf8
 from jinja2 import Environment, FileSystemLoader
+from .clock_alignment import estimate_clock_offsets, get_device_offsets
+from .critical_path import analyze_critical_path
+from .event_table import EventTable, StringColumn, assign_rows
+from .lod import LanePyramid
 
 __author__ = 'Sayed Hadi Hashemi'
 
 
 class TimelineVisualizer:
-    def __init__(self, data_loader):
+    """
+    Renders the events of a DataLoader as a Bokeh timeline.
+
+    Args:
+        data_loader (DataLoader): the source of events.
+        details_url (str): when set, the details of a clicked event are fetched from ``details_url + event_idx``.
+        embed_details (bool): embeds the details of every event in the page instead. This makes the page considerably
+        larger and is meant for standalone HTML exports. (default: False)
+        tiles_url (str): when set, the page embeds only the coarsest level of detail of each lane and fetches the
+        events of the visible range from ``tiles_url`` as the user zooms, see :class:`tftracer.lod.LanePyramid`.
+        The pyramids are kept in ``pyramids`` after :func:`visualize`.
+        resources_url (str): when set, the page loads the Bokeh JS/CSS from ``resources_url + "static/..."`` instead
+        of inlining them, see :func:`get_resources_dir`. (default: None)
+        single_canvas (bool): draws all devices into one figure with one data source, one band of rows per device,
+        instead of one figure per device. Pages with many devices load much faster. Cannot be combined with
+        ``tiles_url``. (default: False)
+    """
+    plot_width = 1200
+
+    def __init__(self, data_loader, details_url=None, embed_details=False, tiles_url=None, resources_url=None,
+                 single_canvas=False):
+        if single_canvas and tiles_url is not None:
+            raise ValueError("single_canvas cannot be combined with tiles_url")
+        self._details_url = details_url
+        self._embed_details = embed_details
+        self._tiles_url = tiles_url
+        self._single_canvas = single_canvas
+        self._resources = INLINE if resources_url is None else Resources(mode="server", root_url=resources_url)
+        self.pyramids = None
+        self._data_loader = data_loader
         self._load_templates()
         self._tools = self._get_tools()
-        self._data_loader = data_loader
         self._iteration_time = 0
 
     def visualize(self, output_file=None):
         data = self._data_loader.get_data()
-        self._iteration_time = max([max([event['end'] for event in device['events']]) for device in data])
+        self._iteration_time = max([device['events'].end.max() for device in data])
 
-        device_plots = []
-        for device in data:
-            plot, widget_box = self._generate_device_plot(device)
-            device_plots += [[plot], [widget_box]]
-
-        final_plot = gridplot(
-            device_plots,
-            toolbar_options={
-                'logo': None,
-            },
-            sizing_mode='scale_width'
-        )
+        if self._tiles_url is not None:
+            self.pyramids = [LanePyramid(device['events'], plot_width=self.plot_width) for device in data]
+
+        if self._single_canvas:
+            final_plot = self._generate_single_plot(data)
+        else:
+            device_plots = []
+            for lane, device in enumerate(data):
+                plot, widget_box = self._generate_device_plot(device, lane)
+                device_plots += [[plot], [widget_box]]
+
+            final_plot = gridplot(
+                device_plots,
+                toolbar_options={
+                    'logo': None,
+                },
+                sizing_mode='scale_width'
+            )
 
         result = self._export_to_html(final_plot)
 
@@ -70,8 +111,10 @@ class TimelineVisualizer:
         self._js_on_click_callback = _template_env.get_template("on_click_callback.js").render()
         self._js_update_ranges = _template_env.get_template("update_ranges.js").render()
         self._js_on_hover_callback = _template_env.get_template("on_hover_callback.js").render()
+        self._js_on_range_change_callback = _template_env.get_template("on_range_change_callback.js").render()
         self._main_template = _template_env.get_template("timeline.html")
-        self._tooltips_template = _template_env.get_template("tooltips.html").render()
+        self._tooltips_template = _template_env.get_template("tooltips.html").render(
+            critical_path=self._data_loader.critical_path)
 
     def _get_tools(self):
         def boxed(content, tag='div'):
@@ -87,15 +130,23 @@ class TimelineVisualizer:
                           callback=callback
                           )
 
-        tap = TapTool(callback=CustomJS(code=self._js_on_click_callback))
+        tap = TapTool(callback=CustomJS(args={'details_url': self._details_url or ""},
+                                        code=self._js_on_click_callback))
 
         tools = "xzoom_in,xzoom_out,xpan,xbox_zoom,xwheel_zoom,xwheel_pan,reset,undo,redo,crosshair".split(',')
         tools += [hover, tap]
 
         return tools
 
-    def _generate_device_plot(self, device_events):
-        data_source = self._convert_events_to_datasource(device_events['events'])
+    def _generate_device_plot(self, device_events, lane=0):
+        if self.pyramids is not None:
+            tile = self.pyramids[lane].query(0, self._iteration_time, self._iteration_time / self.plot_width)
+            data_source = ColumnDataSource(data=self.get_tile_data(device_events['events'], tile))
+        else:
+            details = None
+            if self._embed_details:
+                details = self._data_loader.get_details(device_events['events'].node_index)
+            data_source = self._convert_events_to_datasource(device_events['events'], details=details)
         n_rows = device_events['n_rows']
         if n_rows == 0:
             n_rows = 1
@@ -106,7 +157,7 @@ class TimelineVisualizer:
         plot = figure(
             title="{}".format(name),
             plot_height=20 * n_rows + 60,
-            plot_width=1200,
+            plot_width=self.plot_width,
             tools=self._tools,
             sizing_mode='scale_width',
             active_scroll='xwheel_zoom'
@@ -115,13 +166,13 @@ class TimelineVisualizer:
             left='start',
             right='end',
             y='height',
-            color='color',
             height=0.85,
             source=data_source,
             hover_fill_alpha=0.5,
             line_join='round',
             line_cap='round',
-            hover_line_color='red'
+            hover_line_color='red',
+            **self._get_glyph_colors()
         )
 
         plot.x_range = Range1d(0, self._iteration_time, bounds="auto")
@@ -153,33 +204,163 @@ class TimelineVisualizer:
                 code=self._js_on_change_callback)
         )
 
+        if self.pyramids is not None:
+            callback = CustomJS(
+                args={
+                    'plot': plot,
+                    'source': data_source,
+                    'lane': lane,
+                    'tiles_url': self._tiles_url,
+                },
+                code=self._js_on_range_change_callback)
+            plot.x_range.js_on_change('start', callback)
+            plot.x_range.js_on_change('end', callback)
+
         return plot, WidgetBox(button)
 
+    def _generate_single_plot(self, data):
+        # Lanes are stacked top to bottom, each in its own band of rows.
+        base_rows = []
+        total_rows = 0
+        for device in data:
+            base_rows.append(total_rows)
+            total_rows += max(device['n_rows'], 1)
+
+        columns = {}
+        for device, base_row in zip(data, base_rows):
+            details = None
+            if self._embed_details:
+                details = self._data_loader.get_details(device['events'].node_index)
+            lane_data = self._get_events_data(device['events'], base_row=base_row, details=details)
+            for key, value in lane_data.items():
+                columns.setdefault(key, []).append(value)
+        data_source = ColumnDataSource(data={
+            key: np.concatenate(values) if isinstance(values[0], np.ndarray) else list(itertools.chain(*values))
+            for key, values in columns.items()
+        })
+
+        plot = figure(
+            title="TensorFlow Timeline",
+            plot_height=20 * total_rows + 60,
+            plot_width=self.plot_width,
+            tools=self._tools,
+            sizing_mode='scale_width',
+            active_scroll='xwheel_zoom'
+        )
+        plot.hbar(
+            left='start',
+            right='end',
+            y='height',
+            height=0.85,
+            source=data_source,
+            hover_fill_alpha=0.5,
+            line_join='round',
+            line_cap='round',
+            hover_line_color='red',
+            **self._get_glyph_colors()
+        )
+
+        for lane, (device, base_row) in enumerate(zip(data, base_rows)):
+            if lane % 2 == 0:
+                plot.add_layout(BoxAnnotation(bottom=base_row, top=base_row + max(device['n_rows'], 1),
+                                              fill_alpha=0.1, fill_color="gray"))
+
+        plot.x_range = Range1d(0, self._iteration_time, bounds="auto")
+        plot.y_range = Range1d(total_rows, 0)
+
+        # Label each band at its middle; whole numbers stay ints so that they match the tick values in JS.
+        centers = [base_row + max(device['n_rows'], 1) / 2 for device, base_row in zip(data, base_rows)]
+        centers = [int(center) if center == int(center) else center for center in centers]
+        plot.yaxis.ticker = FixedTicker(ticks=centers)
+        plot.yaxis.major_label_overrides = {center: device['name'] for center, device in zip(centers, data)}
+        plot.yaxis.major_tick_line_color = None
+        plot.ygrid.grid_line_color = None
+        plot.toolbar.logo = None
+        return plot
+
+    def _get_glyph_colors(self):
+        if self._data_loader.critical_path:
+            # Ops on the critical path are outlined.
+            return dict(fill_color='color', line_color='line_color', line_width=2)
+        return dict(color='color')
+
     @staticmethod
-    def _convert_events_to_datasource(device_data, base_row=0):
-        def get_col(column_name, offset=None):
-            if offset:
-                return [item[column_name] + offset for item in device_data]
-            else:
-                return [item[column_name] for item in device_data]
-
-        return ColumnDataSource(data=dict(
-            duration=get_col("duration"),
-            start=get_col("start"),
-            end=get_col('end'),
-            height=get_col('row', base_row + 0.5),
-            color=get_col('color'),
-            row=get_col('row', base_row),
-            name=get_col('name'),
-            description=get_col('description'),
-            details=get_col('details'),
-            op=get_col('op'),
-            inputs=["".join(["<li>{}</li>".format(i) for i in item.split()]) for item in get_col('inputs')]
-        ))
+    def _get_critical_path_data(device_data, index=None):
+        critical = device_data.critical if index is None else device_data.critical[index]
+        slack = device_data.slack if index is None else device_data.slack[index]
+        color = device_data.color.decode() if index is None else device_data.color.take(index).decode()
+        return dict(
+            slack=np.where(np.isnan(slack), None, np.round(slack, 3)).tolist(),
+            line_color=np.where(critical, _CRITICAL_PATH_COLOR, color).tolist(),
+        )
+
+    @staticmethod
+    def get_tile_data(device_data, tile):
+        """
+        Returns the columns of the data source of a lane for the events of a :func:`tftracer.lod.LanePyramid.query`.
+        Merged events are labeled by their number of ops and take the op and color of the longest one.
+
+        Returns:
+            dict: lists of JSON-compatible values.
+        """
+        index = tile["index"]
+        count = tile["count"]
+        merged = count > 1
+        name = device_data.name.take(index).decode()
+        description = device_data.description.take(index).decode()
+        inputs = device_data.inputs.take(index).map(_inputs_to_html).decode()
+        if merged.any():
+            name[merged] = ["{} ops".format(n) for n in count[merged].tolist()]
+            description[merged] = ["{} ops merged, longest: {}".format(n, label)
+                                   for n, label in zip(count[merged].tolist(), description[merged])]
+            inputs[merged] = ""
+        row = device_data.row[index]
+        data = dict(
+            duration=np.where(merged, tile["busy"], device_data.duration[index]).tolist(),
+            start=tile["start"].tolist(),
+            end=tile["end"].tolist(),
+            height=(row + 0.5).tolist(),
+            color=device_data.color.take(index).decode().tolist(),
+            row=row.tolist(),
+            name=name.tolist(),
+            description=description.tolist(),
+            event_idx=device_data.node_index[index].tolist(),
+            op=device_data.op.take(index).decode().tolist(),
+            inputs=inputs.tolist(),
+            count=count.tolist(),
+        )
+        if device_data.critical is not None:
+            data.update(TimelineVisualizer._get_critical_path_data(device_data, index))
+        return data
+
+    @classmethod
+    def _convert_events_to_datasource(cls, device_data, base_row=0, details=None):
+        return ColumnDataSource(data=cls._get_events_data(device_data, base_row, details))
+
+    @staticmethod
+    def _get_events_data(device_data, base_row=0, details=None):
+        data = dict(
+            duration=device_data.duration,
+            start=device_data.start,
+            end=device_data.end,
+            height=device_data.row + (base_row + 0.5),
+            color=device_data.color.decode().tolist(),
+            row=device_data.row + base_row,
+            name=device_data.name.decode().tolist(),
+            description=device_data.description.decode().tolist(),
+            event_idx=device_data.node_index,
+            op=device_data.op.decode().tolist(),
+            inputs=device_data.inputs.map(_inputs_to_html).decode().tolist()
+        )
+        if details is not None:
+            data["details"] = details
+        if device_data.critical is not None:
+            data.update(TimelineVisualizer._get_critical_path_data(device_data))
+        return data
 
     def _export_to_html(self, plot):
-        js_resources = INLINE.render_js()
-        css_resources = INLINE.render_css()
+        js_resources = self._resources.render_js()
+        css_resources = self._resources.render_css()
 
         script, div = components(plot)
         html = self._main_template.render(
@@ -197,120 +378,167 @@ class TimelineVisualizer:
         return encode_utf8(html)
 
 
+def get_resources_dir():
+    """
+    Returns:
+        str: the directory of the installed BokehJS files, served under ``static/`` for ``resources_url``.
+    """
+    try:
+        from bokeh.settings import settings
+        return settings.bokehjsdir()
+    except (ImportError, AttributeError):
+        from bokeh.util.paths import bokehjsdir
+        return bokehjsdir()
+
+
+_CRITICAL_PATH_COLOR = "black"
+
+
+def _inputs_to_html(inputs):
+    return "".join(["<li>{}</li>".format(i) for i in inputs.split()])
+
+
+_EVENT_DESCRIPTION_RE = re.compile(r'(.*) = (.*)\((.*)\)')
+
+
+@lru_cache(maxsize=2 ** 16)
+def parse_event_description(label):
+    """
+    Parses the fields in a node timeline label. Results are cached per process, so traces rendered by the same
+    tracing server share the parsed labels.
+
+    Returns:
+        tuple: (name, op, inputs)
+    """
+    # Expects labels of the form: name = op(arg, arg, ...).
+    match = _EVENT_DESCRIPTION_RE.match(label)
+    if match is None:
+        return 'unknown', 'unknown', ()
+    nn, op, inputs = match.groups()
+    if not inputs:
+        inputs = ()
+    else:
+        inputs = tuple(inputs.split(', '))
+    return nn, op, inputs
+
+
+@lru_cache(maxsize=2 ** 12)
+def op_color(op):
+    """Returns the color of an op type. Colors are seeded by the op name, hence stable across traces."""
+    rand = random.Random(op)
+    return "#%02x%02x%02x" % (rand.randint(0, 256), rand.randint(0, 256), rand.randint(0, 256))
+
+
 class DataLoader:
-    def __init__(self, run_metadata, device_pattern=None):
+    def __init__(self, run_metadata, device_pattern=None, clock_offsets=None, critical_path=False):
         self._device_pattern_re = re.compile(device_pattern if device_pattern else "^.*$")
+        self._run_metadata = run_metadata
         self._step_stats = run_metadata.step_stats
+        self._node_offsets = None
+        self.critical_path = critical_path
+        self._clock_offsets = clock_offsets
         self.comm_op_name = "RecvTensor"
 
     @staticmethod
     def _assign_row(events):
-        rows = []
-        for event in sorted(events, key=lambda x: x['start']):
-            assigned = False
-            for i, row in enumerate(rows):
-                if row <= event['start']:
-                    event['row'] = i
-                    rows[i] = event['end']
-                    assigned = True
-                    break
-            if not assigned:
-                event['row'] = len(rows)
-                rows.append(event['end'])
-        return len(rows)
+        events.row, n_rows = assign_rows(events.start, events.end)
+        return n_rows
 
     @staticmethod
     def _assign_color(events):
-        for event in events:
-            rand = random.Random(event['op'])
-            event['color'] = "#%02x%02x%02x" % (rand.randint(0, 256), rand.randint(0, 256), rand.randint(0, 256))
+        events.color = events.op.map(op_color)
 
     @staticmethod
     def _parse_event_description(label):
         """Parses the fields in a node timeline label."""
-        # Expects labels of the form: name = op(arg, arg, ...).
-        match = re.match(r'(.*) = (.*)\((.*)\)', label)
-        if match is None:
-            return 'unknown', 'unknown', []
-        nn, op, inputs = match.groups()
-        if not inputs:
-            inputs = []
-        else:
-            inputs = inputs.split(', ')
-        return nn, op, inputs
+        return parse_event_description(label)
 
     def _fix_op_names(self, events):
-        for event in events:
-            _, op, inputs = self._parse_event_description(event['description'])
+        # Labels are parsed once per distinct description; events with an unknown op fall back to their name.
+        ops = {}
+        description_op = np.full(len(events.description.categories), -1, dtype=np.int32)
+        inputs = []
+        for i, label in enumerate(events.description.categories):
+            _, op, op_inputs = self._parse_event_description(label)
             if op == "unknown":
-                op = event['name']
-                inputs = ""
-            event['op'] = op
-            event['inputs'] = "\n\n".join(inputs)
-
-    def _process_device(self, device_name, node_stats, base_timestamp):
-        device_events = []
-
-        for node in node_stats:
-            device_events.append(dict(
-                start=(node.all_start_micros - base_timestamp) / 1000,
-                end=(max(node.all_end_rel_micros, 1) + node.all_start_micros - base_timestamp) / 1000,
-                duration=node.all_end_rel_micros / 1000,
-                name=node.node_name,
-                description=node.timeline_label,
-                details=str(node).replace("\n", "\n\n")
-            ))
-
-        self._fix_op_names(device_events)
-        self._assign_color(device_events)
-        n_rows = self._assign_row(device_events)
+                op_inputs = ""
+            else:
+                description_op[i] = ops.setdefault(op, len(ops))
+            inputs.append("\n\n".join(op_inputs))
+
+        op_codes = description_op[events.description.codes]
+        unknown = op_codes < 0
+        if unknown.any():
+            name_op = np.full(len(events.name.categories), -1, dtype=np.int32)
+            for name_code in np.unique(events.name.codes[unknown]):
+                name_op[name_code] = ops.setdefault(events.name.categories[name_code], len(ops))
+            op_codes[unknown] = name_op[events.name.codes[unknown]]
+
+        events.op = StringColumn(op_codes, list(ops))
+        events.inputs = StringColumn(events.description.codes, inputs)
+
+    def _process_device(self, device_name, events):
+        n_rows = self._assign_row(events)
 
         return dict(
             name=device_name,
             n_rows=n_rows,
-            events=device_events
+            events=events
         )
 
-    def _find_minimum_timestamp(self):
-        return min([
-            min([node.all_start_micros for node in device.node_stats])
-            for device in self._step_stats.dev_stats if len(self._device_pattern_re.findall(device.device)) > 0
-        ])
+    def _is_device_included(self, device_name):
+        if len(self._device_pattern_re.findall(device_name)) == 0:
+            print(("ignoring device: {}".format(device_name)))
+            return False
+        return True
+
+    def get_details(self, node_indices):
+        """
+        Returns:
+            list: the text representation of the ``NodeExecStats`` of each of the node_indices.
+        """
+        if self._node_offsets is None:
+            # Built once and shared by the calls for each lane.
+            self._node_offsets = np.cumsum([0] + [len(device.node_stats) for device in self._step_stats.dev_stats])
+        dev_stats = self._step_stats.dev_stats
+        devices = np.searchsorted(self._node_offsets, node_indices, side="right") - 1
+        return [str(dev_stats[device].node_stats[index - self._node_offsets[device]])
+                for device, index in zip(devices.tolist(), np.asarray(node_indices).tolist())]
+
+    def get_event_table(self):
+        """
+        Returns:
+            EventTable: the events of all included devices, with op names and colors assigned.
+        """
+        events = EventTable.from_step_stats(self._step_stats, self._is_device_included, self.comm_op_name)
+        if self._clock_offsets == "auto":
+            events.shift(get_device_offsets(events.devices, estimate_clock_offsets(events)))
+        elif self._clock_offsets:
+            events.shift(get_device_offsets(events.devices, self._clock_offsets))
+        self._fix_op_names(events)
+        self._assign_color(events)
+        if self.critical_path:
+            self._assign_critical_path(events)
+        return events
 
-    def __is_communication_op(self, op):
-        if " = HorovodAllreduce(" in op.timeline_label:
-            return True
-        else:
-            return op.node_name == self.comm_op_name
+    def _assign_critical_path(self, events):
+        result = analyze_critical_path(self._run_metadata)
+        on_path = set(node["name"] for node in result["path"])
+        critical = np.array([name in on_path for name in events.name.categories], dtype=np.bool_)
+        slack = np.array([result["slack"].get(name, np.nan) for name in events.name.categories], dtype=np.float64)
+        events.critical = critical[events.name.codes] if len(critical) > 0 else np.zeros(len(events), np.bool_)
+        events.slack = slack[events.name.codes] / 1000 if len(slack) > 0 else np.zeros(len(events))
 
     def get_data(self):
-        stats = self._step_stats
+        table = self.get_event_table()
         events = []
 
-        base_timestamp = self._find_minimum_timestamp()
-
-        for device in stats.dev_stats:
-            device_name = device.device
-            if len(self._device_pattern_re.findall(device_name)) == 0:
-                print(("ignoring device: {}".format(device_name)))
-                continue
-            device_events = self._process_device(
-                device_name,
-                [node for node in device.node_stats if
-                 not self.__is_communication_op(node)],
-                base_timestamp
-            )
-            if len(device_events["events"]) > 0:
-                events.append(device_events)
-
-            device_events = self._process_device(
-                device_name + " (Communication)",
-                [node for node in device.node_stats if
-                 self.__is_communication_op(node)],
-                base_timestamp
-            )
-            if len(device_events["events"]) > 0:
-                events.append(device_events)
+        for device_id, device_name in enumerate(table.devices):
+            on_device = table.device == device_id
+            for is_comm, lane_name in ((False, device_name), (True, device_name + " (Communication)")):
+                indices = np.flatnonzero(on_device & (table.is_comm == is_comm))
+                if len(indices) > 0:
+                    events.append(self._process_device(lane_name, table.take(indices)))
 
         events.sort(key=lambda x: x['name'])
         return events
@@ -0,0 +1,210 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+class TraceStore:
+    """
+    Keeps ``RunMetadata`` traces keyed by ``(run_id, trace_id)`` within a memory budget. When the traces in memory
+    exceed ``max_bytes``, traces are spilled to ``spill_dir`` and read back from there on :func:`get`. Traces can also
+    be backed by a session file, see :func:`attach`.
+
+    Args:
+        max_bytes (int): memory budget as the sum of ``RunMetadata.ByteSize()``. If None, nothing is spilled.
+        spill_dir (str): directory for spilled traces. If None, a temporary directory is created on the first spill
+        and removed with the store.
+        eviction_policy (str): which trace to spill first: "oldest" (first stored), "lru" (least recently read) or
+        "largest".
+    """
+    eviction_policies = ("oldest", "lru", "largest")
+
+    def __init__(self, max_bytes=None, spill_dir=None, eviction_policy="oldest"):
+        if eviction_policy not in self.eviction_policies:
+            raise ValueError("Unknown eviction policy: {}".format(eviction_policy))
+        self._max_bytes = max_bytes
+        self._spill_dir = spill_dir
+        self._eviction_policy = eviction_policy
+        self._traces = OrderedDict()
+        self._sizes = {}
+        self._spilling = {}
+        self._spilled = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._finalizer = None
+
+    def __getstate__(self):
+        with self._lock:
+            traces = OrderedDict(self._traces)
+            traces.update(self._spilling)
+            locations = dict(self._spilled)
+        spilled = {}
+        for key, location in locations.items():
+            data = self._read(location, key)
+            if data is not None:
+                spilled[key] = data
+        return {
+            "max_bytes": self._max_bytes,
+            "eviction_policy": self._eviction_policy,
+            "traces": traces,
+            "spilled": spilled,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(state["max_bytes"], None, state["eviction_policy"])
+        for key, run_metadata in state["traces"].items():
+            self._traces[key] = run_metadata
+            self._sizes[key] = run_metadata.ByteSize()
+            self._bytes += self._sizes[key]
+        for key, data in state["spilled"].items():
+            self._spilled[key] = self._write(self._get_spill_dir(), key, data)
+
+    def attach(self, session_file):
+        """
+        Makes the traces of a :class:`tftracer.session_file.SessionFile` available. They are read from the file when
+        requested and never held in memory by the store.
+        """
+        with self._lock:
+            for key in session_file.trace_keys():
+                self._spilled[key] = session_file
+
+    @property
+    def memory_bytes(self):
+        return self._bytes
+
+    def put(self, key, run_metadata, size=None):
+        """
+        Stores a trace. ``size`` is its ``ByteSize()`` if already known. Traces over the memory budget are written to
+        the disk after the lock is released, so readers are not held up by the spill.
+        """
+        size = run_metadata.ByteSize() if size is None else size
+        with self._lock:
+            location = self._discard(key)
+            self._traces[key] = run_metadata
+            self._sizes[key] = size
+            self._bytes += size
+            victims = self._pick_victims()
+            spill_dir = self._get_spill_dir() if victims else None
+        self._remove(location)
+        for victim, victim_metadata in victims:
+            path = self._write(spill_dir, victim, victim_metadata.SerializeToString())
+            with self._lock:
+                if self._spilling.get(victim) is victim_metadata:
+                    del self._spilling[victim]
+                    self._spilled[victim] = path
+                    path = None
+            # The trace was discarded or replaced while being written.
+            self._remove(path)
+
+    def get(self, key):
+        """
+        Returns:
+            the trace stored under key, reading it from the disk if it was spilled, or None if there is no such trace.
+        """
+        with self._lock:
+            if key in self._traces:
+                if self._eviction_policy == "lru":
+                    self._traces.move_to_end(key)
+                return self._traces[key]
+            if key in self._spilling:
+                return self._spilling[key]
+            location = self._spilled.get(key)
+        data = self._read(location, key)
+        if data is None:
+            return None
+
+        from tensorflow import RunMetadata
+        return RunMetadata.FromString(data)
+
+    def get_bytes(self, key):
+        """
+        Returns:
+            bytes: the serialized trace stored under key, or None.
+        """
+        with self._lock:
+            run_metadata = self._traces.get(key, self._spilling.get(key))
+            location = self._spilled.get(key)
+        if run_metadata is not None:
+            return run_metadata.SerializeToString()
+        return self._read(location, key)
+
+    def discard(self, key):
+        with self._lock:
+            location = self._discard(key)
+        self._remove(location)
+
+    def keys(self):
+        with self._lock:
+            return list(self._traces) + list(self._spilling) + list(self._spilled)
+
+    def __contains__(self, key):
+        return key in self._traces or key in self._spilling or key in self._spilled
+
+    def _discard(self, key):
+        """Forgets a trace; returns the spill file to remove once the lock is released, if any."""
+        if key in self._traces:
+            del self._traces[key]
+            self._bytes -= self._sizes.pop(key)
+        elif key in self._spilling:
+            del self._spilling[key]
+        elif key in self._spilled:
+            return self._spilled.pop(key)
+        return None
+
+    def _pick_victims(self):
+        victims = []
+        if self._max_bytes is None:
+            return victims
+        while self._bytes > self._max_bytes and len(self._traces) > 0:
+            if self._eviction_policy == "largest":
+                key = max(self._traces, key=self._sizes.get)
+            else:
+                key = next(iter(self._traces))
+            run_metadata = self._traces.pop(key)
+            self._bytes -= self._sizes.pop(key)
+            # Still served from memory until it is written.
+            self._spilling[key] = run_metadata
+            victims.append((key, run_metadata))
+        return victims
+
+    def _get_spill_dir(self):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="tftracer-")
+            self._finalizer = weakref.finalize(self, shutil.rmtree, self._spill_dir, ignore_errors=True)
+        elif not os.path.exists(self._spill_dir):
+            os.makedirs(self._spill_dir)
+        return self._spill_dir
+
+    @staticmethod
+    def _write(spill_dir, key, data):
+        fd, path = tempfile.mkstemp(prefix="{}-{}-".format(*key), suffix=".pb", dir=spill_dir)
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        return path
+
+    @staticmethod
+    def _read(location, key):
+        if location is None:
+            return None
+        if not isinstance(location, str):
+            return location.get_trace_bytes(key)
+        try:
+            with open(location, "rb") as fp:
+                return fp.read()
+        except (IOError, OSError):
+            # Discarded since the lock was released.
+            return None
+
+    @staticmethod
+    def _remove(location):
+        if isinstance(location, str):
+            try:
+                os.remove(location)
+            except (IOError, OSError):
+                pass
@@ -0,0 +1,99 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import time
+
+import tensorflow as tf
+
+from .run_key import get_run_key
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+class TracingServerHook(tf.train.SessionRunHook):
+    def __init__(self, source, tracing_policy=None, partition_graphs=False):
+        self._source = source
+        self._tracing_policy = tracing_policy
+        self._partition_graphs = partition_graphs
+        self._traced = False
+
+    def begin(self):
+        super().begin()
+        self._source.running = True
+
+    def after_create_session(self, session, coord):
+        super().after_create_session(session, coord)
+
+    def before_run(self, run_context):
+        super().before_run(run_context)
+        self._source.before_run(run_context)
+        self._traced = self._source.is_tracing_on(run_context)
+        if self._tracing_policy is not None:
+            key = self._source.get_run_context_key(run_context)
+            self._traced = self._tracing_policy.before_run(key) or self._traced
+        if self._traced:
+            opts = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE,
+                                 output_partition_graphs=self._partition_graphs)
+            return tf.train.SessionRunArgs(None, None, options=opts)
+        else:
+            return None
+
+    def after_run(self, run_context, run_values):
+        super().after_run(run_context, run_values)
+        key = self._source.get_run_context_key(run_context)
+        runtime = self._source.add_run(run_context, run_values)
+        if self._tracing_policy is not None:
+            self._tracing_policy.after_run(key, self._traced, runtime)
+
+    def end(self, session):
+        super().end(session)
+        self._source.running = False
+
+
+class CollectorHook(tf.train.SessionRunHook):
+    def __init__(self, client, tracing_policy, partition_graphs=False):
+        self._client = client
+        self._tracing_policy = tracing_policy
+        self._partition_graphs = partition_graphs
+        self._global_step_tensor = None
+        self._steps = {}
+        self._runs = {}
+        self._key = None
+        self._traced = False
+        self._start_time = None
+
+    def begin(self):
+        super().begin()
+        self._global_step_tensor = tf.train.get_global_step()
+
+    def before_run(self, run_context):
+        super().before_run(run_context)
+        args = run_context.original_args
+        self._key = get_run_key(args)
+        if self._key not in self._runs:
+            self._runs[self._key] = (repr(self._key), {
+                "fetches": repr(args.fetches),
+                "feeds": repr(args.feed_dict),
+                "options": repr(args.options)
+            })
+        self._traced = self._tracing_policy.before_run(self._key)
+        self._start_time = time.time()
+        if self._traced:
+            opts = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE,
+                                 output_partition_graphs=self._partition_graphs)
+            return tf.train.SessionRunArgs(None, None, options=opts)
+        else:
+            return None
+
+    def after_run(self, run_context, run_values):
+        super().after_run(run_context, run_values)
+        runtime = time.time() - self._start_time
+        step = self._steps.get(self._key, 0)
+        self._steps[self._key] = step + 1
+        if self._traced and run_values.run_metadata.ByteSize() > 0:
+            run_key, info = self._runs[self._key]
+            global_step = None
+            if self._global_step_tensor is not None:
+                # Read after the step, so every worker of a synchronous job reads the same value.
+                global_step = int(run_context.session.run(self._global_step_tensor))
+            self._client.submit(run_key, info, step, runtime, run_values.run_metadata, global_step)
+        self._tracing_policy.after_run(self._key, self._traced, runtime)
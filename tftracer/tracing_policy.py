@@ -0,0 +1,134 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+from __future__ import division
+
+import random
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+class TracingPolicy:
+    """
+    Decides which session runs are traced, in addition to the traces requested from the web interface.
+    Steps are counted separately for each run, i.e. for each distinct set of fetches and feeds.
+
+    Example:
+
+        .. code-block:: python
+
+            tracing_server = TracingServer(tracing_policy=EveryNStepsPolicy(100))
+    """
+    def __init__(self):
+        self._steps = {}
+
+    def before_run(self, run_key):
+        """
+        Returns:
+            bool: whether the next step of the run should be traced.
+        """
+        step = self._steps.get(run_key, 0)
+        self._steps[run_key] = step + 1
+        return self.should_trace(run_key, step)
+
+    def should_trace(self, run_key, step):
+        raise NotImplementedError
+
+    def after_run(self, run_key, traced, runtime):
+        """
+        Called after every step with its runtime in seconds.
+        """
+        pass
+
+
+class EveryNStepsPolicy(TracingPolicy):
+    """
+    Traces every n-th step of each run, starting from ``offset``.
+    """
+    def __init__(self, n, offset=0):
+        super().__init__()
+        self._n = n
+        self._offset = offset
+
+    def should_trace(self, run_key, step):
+        return step >= self._offset and (step - self._offset) % self._n == 0
+
+
+class ProbabilisticPolicy(TracingPolicy):
+    """
+    Traces each step with the given probability.
+    """
+    def __init__(self, probability, seed=None):
+        super().__init__()
+        self._probability = probability
+        self._random = random.Random(seed)
+
+    def should_trace(self, run_key, step):
+        return self._random.random() < self._probability
+
+
+class WarmupPolicy(TracingPolicy):
+    """
+    Traces ``num_traces`` consecutive steps of each run after skipping the first ``warmup_steps`` steps.
+    """
+    def __init__(self, warmup_steps, num_traces=1):
+        super().__init__()
+        self._warmup_steps = warmup_steps
+        self._num_traces = num_traces
+
+    def should_trace(self, run_key, step):
+        return self._warmup_steps <= step < self._warmup_steps + self._num_traces
+
+
+class AdaptivePolicy(TracingPolicy):
+    """
+    Traces as often as possible while keeping the tracing overhead under ``max_overhead`` of the wall time.
+
+    The overhead of a traced step is its runtime minus the average runtime of untraced steps of the same run.
+    A step is traced only if the overhead spent so far, plus the expected overhead of this step, stays within the
+    budget.
+
+    Args:
+        max_overhead (float): the overhead budget as a fraction of the total runtime. (default: 0.05)
+        warmup_steps (int): untraced steps of a run to measure before tracing it. (default: 10)
+        smoothing (float): weight of the latest sample in the moving averages of the runtimes. (default: 0.1)
+    """
+    def __init__(self, max_overhead=0.05, warmup_steps=10, smoothing=0.1):
+        super().__init__()
+        self._max_overhead = max_overhead
+        self._warmup_steps = warmup_steps
+        self._smoothing = smoothing
+        self._untraced = {}
+        self._overhead = {}
+        self._spent = 0.0
+        self._wall_time = 0.0
+
+    @property
+    def overhead(self):
+        """
+        Returns:
+            float: the measured tracing overhead as a fraction of the total runtime.
+        """
+        return self._spent / self._wall_time if self._wall_time > 0 else 0.0
+
+    def _average(self, averages, run_key, value):
+        count, average = averages.get(run_key, (0, 0.0))
+        weight = max(self._smoothing, 1 / (count + 1))
+        averages[run_key] = (count + 1, average + weight * (value - average))
+
+    def should_trace(self, run_key, step):
+        count, untraced = self._untraced.get(run_key, (0, 0.0))
+        if count < self._warmup_steps:
+            return False
+        # Before the first trace of a run, assume tracing doubles its step time.
+        _, expected = self._overhead.get(run_key, (0, untraced))
+        return self._spent + expected <= self._max_overhead * (self._wall_time + untraced + expected)
+
+    def after_run(self, run_key, traced, runtime):
+        self._wall_time += runtime
+        if traced:
+            _, untraced = self._untraced.get(run_key, (0, runtime))
+            overhead = max(runtime - untraced, 0.0)
+            self._spent += overhead
+            self._average(self._overhead, run_key, overhead)
+        else:
+            self._average(self._untraced, run_key, runtime)
@@ -9,14 +9,27 @@ __author__ = 'Sayed Hadi Hashemi'
 
 import datetime
 import json
+import logging
 import os
+import tempfile
 from collections import OrderedDict
-from copy import deepcopy
 from gevent.pywsgi import WSGIServer
+import bokeh
 import flask
 import threading
+import uuid
+from urllib.parse import urlencode
+from .chrome_trace import iter_chrome_trace
+from .collector import decode_batch
+from .event_table import get_node_stats
+from .lod import LanePyramid
+from .op_stats import OpStats, OpStatsUpdater
+from .run_key import get_run_key
+from .session_file import SessionFile, SessionWriter, encode_profile, decode_profile, is_session_file
+from .session_log import SessionLog
 from .timeline import Timeline
-import tensorflow as tf
+from .timeline_visualizer import DataLoader, TimelineVisualizer, get_resources_dir
+from .trace_store import TraceStore
 from .version import __version__
 
 class VisualizationServerBase:
@@ -42,8 +55,8 @@ class VisualizationServerBase:
         if not self._server_thread:
             self._server_thread = threading.Thread(target=self._start_server)
             self._server_thread.start()
-            tf.logging.warn("Tracing Server: http://{}:{}/".format(self._server_ip,
-                                                                   self._server_port))
+            logging.getLogger("tensorflow").warning("Tracing Server: http://{}:{}/".format(self._server_ip,
+                                                                                           self._server_port))
 
     def stop_web_server(self):
         """
@@ -69,6 +82,66 @@ class VisualizationServerBase:
         raise NotImplemented
 
 
+class RenderCache:
+    """
+    A LRU cache of rendered timelines whose total size is bounded by ``max_bytes``.
+    """
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key, None)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        size = len(value)
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = value
+            self._size += size
+            while self._size > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, run_id, trace_id):
+        """Drops all the cached renderings of a trace."""
+        with self._lock:
+            for key in [key for key in self._entries if key[:2] == (run_id, trace_id)]:
+                self._size -= len(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self._max_bytes,
+            }
+
+
 class VisualizationServer(VisualizationServerBase):
     _static_folder = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'resources/web/')
 
@@ -77,51 +150,215 @@ class VisualizationServer(VisualizationServerBase):
         self._name = name
         self._source = source
         self._keep_traces = kwargs.get("keep_traces", 5)
+        self._render_cache = RenderCache(kwargs.get("render_cache_bytes", 256 * 1024 * 1024))
+        self._clock_offsets = kwargs.get("clock_offsets", None)
+        self._resources_url = "/bokeh/{}/".format(bokeh.__version__)
+        self._lod_min_events = kwargs.get("lod_min_events", 100000)
+        self._single_canvas = kwargs.get("single_canvas", False)
+        self._pyramids = OrderedDict()
+        self._max_pyramids = kwargs.get("lod_cache_traces", 4)
+        self._pyramids_lock = threading.Lock()
+        self._source.add_eviction_listener(self._invalidate_trace)
+
+    def _format_run(self, run):
+        run_id = run["run_id"]
+        stats = run["stats"]
+        return {
+            "run_id": run_id,
+            "info": run["info"],
+            "tracing": run["tracing"],
+            "burst": run.get("burst", None),
+            "trace_url": "/trace/{}".format(run_id),
+            "stats": {
+                "runs": stats["runs"],
+                "traces": stats["traces"],
+                "runtime_avg": str(stats["runtimes"]),
+                "first_run": str(stats["first_run"]),
+                "last_run": str(stats["last_run"]),
+            },
+            "traces": [
+                {
+                    "trace_id": trace["trace_id"],
+                    "title": str(trace["date"]),
+                    "url": "/{}/{}".format(run_id, trace["trace_id"]),
+                    "download_url": "/download/{}/{}".format(run_id, trace["trace_id"]),
+                    "chrome_trace_url": "/download/{}/{}?format=chrome".format(run_id, trace["trace_id"]),
+                }
+                for trace in run["traces"][-self._keep_traces:]
+            ],
+        }
 
     def _handle_update(self):
-        runs = self._source.get_runs()
+        since = flask.request.args.get("since", 0, type=int)
+        session_id = self._source.session_id
+        if flask.request.args.get("session", session_id) != session_id:
+            since = 0
+        revision = self._source.revision
+        if since > revision:
+            since = 0
+
+        # The ETag describes the state of the session only; ``since`` just selects what the body includes.
+        running = self._source.running
+        global_tracing = self._source.global_tracing
+        if flask.request.if_none_match.contains(self._get_update_etag(session_id, revision, running, global_tracing)):
+            return flask.Response(status=304)
+
+        revision, runs = self._source.get_changes(since)
         response = {
-            "running": self._source.running,
-            "global_tracing": self._source.global_tracing,
-            "runs": deepcopy(runs),
+            "session": session_id,
+            "revision": revision,
+            "full": since == 0,
+            "running": running,
+            "global_tracing": global_tracing,
+            "runs": [self._format_run(run) for run in runs],
         }
-        for run in response["runs"]:
-            run_id = run["run_id"]
-            run["trace_url"] = "/trace/{}".format(run_id)
+        response = flask.Response(json.dumps(response), mimetype="application/json")
+        response.set_etag(self._get_update_etag(session_id, revision, running, global_tracing))
+        return response
 
-            run["stats"]["runtime_avg"] = str(run["stats"]["runtimes"])
-            del run["stats"]["runtimes"]
-
-            run["stats"]["first_run"] = str(run["stats"]["first_run"])
-            run["stats"]["last_run"] = str(run["stats"]["last_run"])
-
-            run["traces"] = run["traces"][-self._keep_traces:]
-
-            for trace in run["traces"]:
-                trace_id = trace["trace_id"]
-                trace["title"] = str(trace["date"])
-                del trace["date"]
-                trace["url"] = "/{}/{}".format(run_id, trace_id)
-                trace["download_url"] = "/download/{}/{}".format(run_id, trace_id)
-
-        return json.dumps(response)
+    @staticmethod
+    def _get_update_etag(session_id, revision, running, global_tracing):
+        return "{}-{}-{:d}{:d}".format(session_id, revision, running, global_tracing)
 
     def _handle_main(self):
         with open(os.path.join(self._static_folder, "main.html")) as fp:
             return fp.read()
 
+    def _invalidate_trace(self, run_id, trace_id):
+        self._render_cache.invalidate(run_id, trace_id)
+        with self._pyramids_lock:
+            for key in [key for key in self._pyramids if key[:2] == (run_id, trace_id)]:
+                del self._pyramids[key]
+
+    def _put_pyramids(self, key, pyramids):
+        with self._pyramids_lock:
+            self._pyramids[key] = pyramids
+            self._pyramids.move_to_end(key)
+            while len(self._pyramids) > self._max_pyramids:
+                self._pyramids.popitem(last=False)
+
+    def _get_pyramids(self, run_id, trace_id, device_pattern, critical_path=False):
+        key = (run_id, trace_id, device_pattern, critical_path)
+        with self._pyramids_lock:
+            if key in self._pyramids:
+                self._pyramids.move_to_end(key)
+                return self._pyramids[key]
+
+        run_metadata = self._source.get_trace(run_id, trace_id)
+        if run_metadata is None:
+            return None
+        data = DataLoader(run_metadata, device_pattern, self._clock_offsets, critical_path=critical_path).get_data()
+        pyramids = [LanePyramid(device["events"], plot_width=TimelineVisualizer.plot_width) for device in data]
+        self._put_pyramids(key, pyramids)
+        return pyramids
+
+    def _use_lod(self, run_metadata, lod):
+        if lod is not None:
+            return bool(lod)
+        if self._lod_min_events is None:
+            return False
+        return sum(len(dev_stats.node_stats) for dev_stats in run_metadata.step_stats.dev_stats) >= \
+            self._lod_min_events
+
     def _handle_timelime(self, run_id, trace_id=0):
+        device_pattern = flask.request.args.get("device_pattern", None)
+        lod = flask.request.args.get("lod", None, type=int)
+        single_canvas = flask.request.args.get("single_canvas", int(self._single_canvas), type=int) == 1
+        critical_path = flask.request.args.get("critical_path", 0, type=int) == 1
+        key = (run_id, trace_id, device_pattern, lod, single_canvas, critical_path)
+        result = self._render_cache.get(key)
+        if result is not None:
+            return result
+
         run_metadata = self._source.get_trace(run_id, trace_id)
         if run_metadata is None:
             return flask.redirect("/")
+        elif self._use_lod(run_metadata, lod):
+            query = dict(critical_path=1) if critical_path else {}
+            if device_pattern:
+                query["device_pattern"] = device_pattern
+            query = urlencode(query) + "&" if query else ""
+            visualizer = TimelineVisualizer(
+                DataLoader(run_metadata, device_pattern, self._clock_offsets, critical_path=critical_path),
+                details_url="/details/{}/{}/".format(run_id, trace_id),
+                tiles_url="/tiles/{}/{}?{}".format(run_id, trace_id, query),
+                resources_url=self._resources_url)
+            result = visualizer.visualize()
+            self._put_pyramids((run_id, trace_id, device_pattern, critical_path), visualizer.pyramids)
         else:
-            result = Timeline(run_metadata=run_metadata).visualize()
-            return result
+            result = Timeline(run_metadata=run_metadata, clock_offsets=self._clock_offsets).visualize(
+                device_pattern=device_pattern,
+                details_url="/details/{}/{}/".format(run_id, trace_id),
+                resources_url=self._resources_url,
+                single_canvas=single_canvas,
+                critical_path=critical_path)
+        self._render_cache.put(key, result)
+        return result
+
+    def _handle_bokeh_resources(self, version, filename):
+        # The version is part of the URL, so the files never change under it and may be cached for good.
+        if version != bokeh.__version__:
+            flask.abort(404)
+        response = flask.send_from_directory(get_resources_dir(), filename)
+        # Flask 2 marks sent files "no-cache", which would make browsers revalidate them on every page load.
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.headers["Cache-Control"] += ", immutable"
+        return response
+
+    def _handle_tiles(self, run_id, trace_id):
+        args = flask.request.args
+        pyramids = self._get_pyramids(run_id, trace_id, args.get("device_pattern", None),
+                                      args.get("critical_path", 0, type=int) == 1)
+        lane = args.get("lane", 0, type=int)
+        if pyramids is None or not 0 <= lane < len(pyramids):
+            flask.abort(404)
+        pyramid = pyramids[lane]
+        tile = pyramid.query(args.get("start", 0.0, type=float), args.get("end", float("inf"), type=float),
+                             args.get("resolution", 0.0, type=float))
+        return flask.Response(json.dumps(TimelineVisualizer.get_tile_data(pyramid.events, tile)),
+                              mimetype="application/json")
+
+    def _handle_ops(self, run_id):
+        op_stats = self._source.get_op_stats(run_id)
+        if op_stats is None:
+            flask.abort(404)
+        args = flask.request.args
+        try:
+            ops = op_stats.top(k=args.get("k", 20, type=int), by=args.get("by", "op"),
+                               sort=args.get("sort", "total"))
+        except ValueError:
+            flask.abort(400)
+        return flask.Response(json.dumps({"run_id": run_id, "traces": op_stats.traces, "ops": ops}),
+                              mimetype="application/json")
+
+    def _handle_render_cache(self):
+        return json.dumps(self._render_cache.stats())
+
+    def _handle_details(self, run_id, trace_id, event_idx):
+        run_metadata = self._source.get_trace(run_id, trace_id)
+        if run_metadata is None:
+            flask.abort(404)
+        try:
+            node_stats = get_node_stats(run_metadata.step_stats, event_idx)
+        except IndexError:
+            flask.abort(404)
+        return flask.Response(str(node_stats), mimetype="text/plain")
 
     def _handle_download(self, run_id, trace_id=0):
         run_metadata = self._source.get_trace(run_id, trace_id)
         if run_metadata is None:
             return flask.redirect("/")
+        elif flask.request.args.get("format", None) == "chrome":
+            data_loader = DataLoader(run_metadata, flask.request.args.get("device_pattern", None),
+                                     self._clock_offsets)
+            return flask.Response(
+                iter_chrome_trace(data_loader),
+                mimetype="application/json",
+                headers={
+                    "Content-Disposition": "attachment; filename=trace-{}-{}.json".format(run_id, trace_id)
+                })
         else:
             fp = BytesIO()
             pickle.dump(run_metadata, fp)
@@ -131,18 +368,32 @@ class VisualizationServer(VisualizationServerBase):
                                    attachment_filename="run_metadata-{}-{}.pickle".format(run_id, trace_id))
 
     def _handle_save_session(self):
-        data = pickle.dumps(self._source)
-        gdata = gzip.compress(data)
-        fp = BytesIO(gdata)
+        fp = tempfile.TemporaryFile()
+        self._source.save(fp)
         fp.seek(0, 0)
         return flask.send_file(fp,
                                as_attachment=True,
-                               attachment_filename="tracing-session.pickle.gz")
+                               attachment_filename="tracing-session.tftrace")
 
     def _handle_enable_tracing(self, run_id):
-        self._source.enable_tracing(run_id)
+        count = flask.request.args.get("count", 1, type=int)
+        every = flask.request.args.get("every", 1, type=int)
+        self._source.enable_tracing(run_id, count=max(count, 1), every=max(every, 1))
         return flask.redirect("/")
 
+    def _handle_collect(self):
+        try:
+            items = decode_batch(flask.request.get_data())
+        except ValueError:
+            flask.abort(400)
+        for metadata, data in items:
+            step = metadata.get("global_step", None)
+            if step is None:
+                step = metadata["step"]
+            self._source.add_collected_trace(metadata["run_key"], metadata["info"], step,
+                                             metadata["rank"], metadata["runtime"], data)
+        return flask.Response(status=204)
+
     def _handle_enable_global_tracing(self):
         self._source.enable_global_tracing()
         return flask.redirect("/")
@@ -159,43 +410,250 @@ class VisualizationServer(VisualizationServerBase):
         app = flask.Flask(self._name, static_folder=self._static_folder, static_url_path="/static")
         app.route("/")(self._handle_main)
         app.route("/<int:run_id>/<int:trace_id>")(self._handle_timelime)
+        app.route("/bokeh/<version>/static/<path:filename>")(self._handle_bokeh_resources)
+        app.route("/tiles/<int:run_id>/<int:trace_id>")(self._handle_tiles)
+        app.route("/details/<int:run_id>/<int:trace_id>/<int:event_idx>")(self._handle_details)
         app.route("/download/<int:run_id>/<int:trace_id>")(self._handle_download)
         app.route("/trace/<int:run_id>")(self._handle_enable_tracing)
         app.route("/update")(self._handle_update)
+        app.route("/collect", methods=["POST"])(self._handle_collect)
         app.route("/enable_global_tracing")(self._handle_enable_global_tracing)
         app.route("/disable_global_tracing")(self._handle_disable_global_tracing)
         app.route("/kill_tracing_server")(self._handle_kill_server)
         app.route("/save_session")(self._handle_save_session)
+        app.route("/render_cache")(self._handle_render_cache)
+        app.route("/ops/<int:run_id>")(self._handle_ops)
         return app
 
 
 class TracingSource:
+    """
+    Keeps the run profiles and traces of a tracing session.
+
+    The hook writes from the training thread and the web server reads from its own thread. Writers hold ``_lock``
+    only for a few dictionary updates; readers copy what they need under the lock and do the slow work (formatting,
+    serialization) on the copy, so the hook never waits on an HTTP request.
+    """
     tftracer_version = __version__
 
     def __init__(self, **kwargs):
         self._run_profile = OrderedDict()
-        self._traces = {}
+        self._trace_store = TraceStore(
+            max_bytes=kwargs.get("max_trace_bytes", 1024 * 1024 * 1024),
+            spill_dir=kwargs.get("trace_spill_dir", None),
+            eviction_policy=kwargs.get("trace_eviction_policy", "oldest"),
+        )
         self.global_tracing = False
         self.running = False
         self._keep_traces = kwargs.get("keep_traces", 5)
+        self._eviction_listeners = []
+        self._lock = threading.Lock()
+        self._collect_lock = threading.Lock()
+        self._collected_steps = {}
+        self._collected_floor = {}
+        self._key_cache = threading.local()
+        self._keep_op_stats = kwargs.get("op_stats", True)
+        self._op_stats = {}
+        self._op_stats_updater = OpStatsUpdater(max_queue=kwargs.get("op_stats_queue_size", 16))
+        self.session_id = uuid.uuid4().hex
+        self.revision = 0
+        self._session_log = None
+        if kwargs.get("session_log", None) is not None:
+            self._session_log = SessionLog(kwargs["session_log"], self,
+                                           max_queue=kwargs.get("session_log_queue_size", 64),
+                                           overflow=kwargs.get("session_log_overflow", "drop"),
+                                           runs_interval=kwargs.get("session_log_runs_interval", 10))
+
+    def __getstate__(self):
+        with self._lock:
+            state = self.__dict__.copy()
+            state["_run_profile"] = OrderedDict(
+                (key, self._snapshot(profile)) for key, profile in self._run_profile.items())
+        del state["_eviction_listeners"]
+        del state["_lock"]
+        del state["_collect_lock"]
+        del state["_key_cache"]
+        del state["_op_stats_updater"]
+        state["_session_log"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._eviction_listeners = []
+        self._lock = threading.Lock()
+        self._collect_lock = threading.Lock()
+        self._collected_steps = state.get("_collected_steps", {})
+        self._collected_floor = state.get("_collected_floor", {})
+        self._keep_op_stats = state.get("_keep_op_stats", True)
+        self._op_stats = state.get("_op_stats", {})
+        self._op_stats_updater = OpStatsUpdater()
+        self._key_cache = threading.local()
+        self._session_log = None
+        if "_traces" in state:
+            # Sessions saved before traces were kept in a TraceStore
+            self._trace_store = TraceStore()
+            for run_id, traces in self._traces.items():
+                for trace_id, run_metadata in enumerate(traces):
+                    if run_metadata is not None:
+                        self._trace_store.put((run_id, trace_id), run_metadata)
+            del self._traces
+        if "revision" not in state:
+            # Sessions saved before revisions were tracked
+            self.session_id = uuid.uuid4().hex
+            self.revision = 1
+            for profile in self._run_profile.values():
+                profile["revision"] = 1
+        for profile in self._run_profile.values():
+            if "next_trace_id" not in profile:
+                # Sessions saved before trace ids were counted
+                profile["next_trace_id"] = max([trace["trace_id"] + 1 for trace in profile["traces"]] or [0])
 
     @staticmethod
-    def get_run_context_key(run_context):
-        return repr(run_context.original_args)
+    def _snapshot(profile):
+        # "info" and the trace entries are never modified after creation, so they can be shared.
+        snapshot = dict(profile)
+        snapshot["stats"] = dict(profile["stats"])
+        snapshot["traces"] = list(profile["traces"])
+        if profile.get("burst", None) is not None:
+            snapshot["burst"] = dict(profile["burst"])
+        return snapshot
+
+    def _touch(self, profile):
+        self.revision += 1
+        profile["revision"] = self.revision
+
+    def get_session_state(self):
+        """
+        Returns:
+            dict: the run profiles and settings of the session as stored in session files.
+        """
+        with self._lock:
+            profiles = [self._snapshot(profile) for profile in self._run_profile.values()]
+        runs = [encode_profile(profile) for profile in profiles]
+        return {
+            "tftracer_version": self.tftracer_version,
+            "keep_traces": self._keep_traces,
+            "runs": runs,
+        }
+
+    def save(self, fp):
+        """
+        Writes the session to a binary file object in the session file format.
+        """
+        writer = SessionWriter(fp)
+        for key in self.get_trace_keys():
+            data = self._trace_store.get_bytes(key)
+            if data is not None:
+                writer.write_trace(key[0], key[1], data)
+        writer.write_runs(self.get_session_state())
+        writer.close()
+
+    @classmethod
+    def from_session_file(cls, session_file, **kwargs):
+        """
+        Creates a source from a :class:`tftracer.session_file.SessionFile`. Traces are read from the file on demand.
+
+        A session log copies the run profiles only every few seconds, so the traces of known runs written after the
+        last copy are added to their runs, dated as the last run.
+        """
+        state = session_file.get_runs() or {"runs": []}
+        if "keep_traces" in state:
+            kwargs.setdefault("keep_traces", state["keep_traces"])
+        source = cls(**kwargs)
+        listed = {}
+        for data in state["runs"]:
+            profile = decode_profile(data)
+            source._run_profile[profile["key"]] = profile
+            listed[profile["run_id"]] = (profile, set(trace["trace_id"] for trace in profile["traces"]))
+        for run_id, trace_id in session_file.trace_keys():
+            profile, trace_ids = listed.get(run_id, (None, ()))
+            if profile is not None and trace_id not in trace_ids:
+                profile["traces"].append({"trace_id": trace_id, "date": profile["stats"]["last_run"]})
+                profile["stats"]["traces"] += 1
+                profile["next_trace_id"] = max(profile["next_trace_id"], trace_id + 1)
+        source.revision = 1
+        source._trace_store.attach(session_file)
+        return source
+
+    def add_eviction_listener(self, listener):
+        """
+        Registers ``listener(run_id, trace_id)`` to be called when a trace is discarded.
+        """
+        self._eviction_listeners.append(listener)
+
+    def get_run_context_key(self, run_context):
+        """
+        Returns a key identifying the run by the names of its fetches, the names of its feeds and its options.
+        The key is computed once per ``SessionRunArgs`` and reused by the calls of the same step.
+        """
+        args = run_context.original_args
+        cache = self._key_cache
+        if getattr(cache, "args", None) is not args:
+            cache.key = get_run_key(args)
+            cache.args = args
+        return cache.key
 
     def get_trace(self, run_id, trace_id):
-        if run_id >= len(self._run_profile):
-            return None
-        if trace_id >= len(self._traces[run_id]):
-            return None
-        return self._traces[run_id][trace_id]
+        return self._trace_store.get((run_id, trace_id))
+
+    def get_trace_bytes(self, run_id, trace_id):
+        """
+        Returns:
+            bytes: the serialized trace, or None if it is not kept.
+        """
+        return self._trace_store.get_bytes((run_id, trace_id))
+
+    def get_trace_keys(self):
+        """
+        Returns:
+            list: ``(run_id, trace_id)`` of the kept traces.
+        """
+        return sorted(self._trace_store.keys())
+
+    def get_op_stats(self, run_id):
+        """
+        Returns:
+            tftracer.op_stats.OpStats: the op statistics of all the traces of a run, or None if it has none.
+        """
+        with self._lock:
+            return self._op_stats.get(run_id, None)
+
+    def _add_op_stats(self, run_id, run_metadata):
+        if not self._keep_op_stats:
+            return
+        with self._lock:
+            op_stats = self._op_stats.get(run_id, None)
+            if op_stats is None:
+                op_stats = self._op_stats[run_id] = OpStats()
+        # Aggregating a large trace takes seconds; keep it off the training thread.
+        self._op_stats_updater.submit(op_stats, run_metadata)
 
     def get_runs(self):
-        return list(self._run_profile.values())
+        """
+        Returns:
+            list: a snapshot of the run profiles.
+        """
+        with self._lock:
+            return [self._snapshot(profile) for profile in self._run_profile.values()]
+
+    def get_changes(self, since=0):
+        """
+        Returns:
+            tuple: (revision, runs) where runs are snapshots of the run profiles changed after the ``since`` revision.
+        """
+        with self._lock:
+            return self.revision, [self._snapshot(profile) for profile in self._run_profile.values()
+                                   if profile["revision"] > since]
 
-    def enable_tracing(self, run_id):
-        profile = list(self._run_profile.values())[run_id]
-        profile["tracing"] = True
+    def enable_tracing(self, run_id, count=1, every=1):
+        """
+        Traces the next ``count`` steps of a run, one in every ``every`` steps.
+        """
+        with self._lock:
+            profile = list(self._run_profile.values())[run_id]
+            profile["tracing"] = True
+            profile["burst"] = {"requested": count, "captured": 0, "every": every, "skip": 0}
+            self._touch(profile)
 
     def enable_global_tracing(self):
         self.global_tracing = True
@@ -207,95 +665,209 @@ class TracingSource:
         if self.global_tracing:
             return True
         key = self.get_run_context_key(run_context)
-        if key in self._run_profile:
-            return self._run_profile[key]["tracing"]
-        else:
-            return False
+        with self._lock:
+            if key in self._run_profile:
+                profile = self._run_profile[key]
+                burst = profile.get("burst", None)
+                return profile["tracing"] and (burst is None or burst["skip"] == 0)
+            else:
+                return False
+
+    def _new_profile(self, key, info, now):
+        profile = {
+            "info": info,
+            "stats": {
+                "runs": 0,
+                "traces": 0,
+                "runtimes": datetime.timedelta(microseconds=0),
+                "first_run": now,
+                "last_run": now,
+            },
+            "traces": [
+            ],
+            "key": key,
+            "run_id": len(self._run_profile),
+            "next_trace_id": 0,
+            "tracing": False,
+            "revision": 0,
+        }
+        self._run_profile[key] = profile
+        return profile
 
     def before_run(self, run_context):
         key = self.get_run_context_key(run_context)
 
         if key not in self._run_profile:
-            run_id = len(self._run_profile)
-            profile = {
-                "info": {
-                    "fetches": repr(run_context.original_args.fetches),
-                    "feeds": repr(run_context.original_args.feed_dict),
-                    "options": repr(run_context.original_args.options)
-                },
-                "stats": {
-                    "runs": 0,
-                    "traces": 0,
-                    "runtimes": datetime.timedelta(microseconds=0),
-                    "first_run": datetime.datetime.now(),
-                    "last_run": datetime.datetime.now(),
-                },
-                "traces": [
-                ],
-                "key": key,
-                "run_id": run_id,
-                "tracing": False,
+            info = {
+                "fetches": repr(run_context.original_args.fetches),
+                "feeds": repr(run_context.original_args.feed_dict),
+                "options": repr(run_context.original_args.options)
             }
-            self._run_profile[key] = profile
-            self._traces[run_id] = []
-        else:
-            profile = self._run_profile[key]
-            profile["stats"]["last_run"] = datetime.datetime.now()
+        now = datetime.datetime.now()
+
+        with self._lock:
+            if key not in self._run_profile:
+                profile = self._new_profile(key, info, now)
+            else:
+                profile = self._run_profile[key]
+                profile["stats"]["last_run"] = now
+            self._touch(profile)
 
     def add_run(self, run_context, run_values):
+        """
+        Records a finished step and keeps its trace, if any.
+
+        Returns:
+            float: the runtime of the step in seconds.
+        """
         key = self.get_run_context_key(run_context)
-        profile = self._run_profile[key]
+        # Last use of the key in this step; do not keep the feeds alive until the next one.
+        self._key_cache.args = None
+        now = datetime.datetime.now()
+        trace_size = run_values.run_metadata.ByteSize()
 
-        # stats
-        num_runs = profile["stats"]["runs"]
-        old_runtime = profile["stats"]["runtimes"]
-        profile["stats"]["runs"] += 1
-        runtime = datetime.datetime.now() - profile["stats"]["last_run"]
-        profile["stats"]["runtimes"] = (runtime + old_runtime * num_runs) / (num_runs + 1)
+        with self._lock:
+            profile = self._run_profile[key]
 
-        if run_values.run_metadata.ByteSize() > 0:
+            # stats
+            num_runs = profile["stats"]["runs"]
+            old_runtime = profile["stats"]["runtimes"]
+            profile["stats"]["runs"] += 1
+            runtime = now - profile["stats"]["last_run"]
+            profile["stats"]["runtimes"] = (runtime + old_runtime * num_runs) / (num_runs + 1)
+            self._touch(profile)
             run_id = profile["run_id"]
-            trace_id = len(self._traces[run_id])
-            self._traces[run_id].append(run_values.run_metadata)
-            profile["tracing"] = False
+            burst = profile.get("burst", None)
+            if trace_size == 0:
+                if burst is not None and burst["skip"] > 0:
+                    burst["skip"] -= 1
+            else:
+                trace_id = profile["next_trace_id"]
+                profile["next_trace_id"] += 1
+
+        if trace_size == 0:
+            return runtime.total_seconds()
+
+        # The trace is stored before it is listed in the profile, so listed traces are always available.
+        self._trace_store.put((run_id, trace_id), run_values.run_metadata, trace_size)
+        if self._session_log is not None:
+            self._session_log.submit(run_id, trace_id, run_values.run_metadata)
+        self._add_op_stats(run_id, run_values.run_metadata)
+        evicted = []
+        with self._lock:
+            burst = profile.get("burst", None)
+            if burst is not None:
+                burst["captured"] += 1
+                burst["skip"] = burst["every"] - 1
+            if burst is None or burst["captured"] >= burst["requested"]:
+                profile["tracing"] = False
+                profile["burst"] = None
             profile["traces"].append(
                 {
                     "trace_id": trace_id,
-                    "date": datetime.datetime.now()
+                    "date": now
                 }
             )
-            profile["stats"]["traces"] = len(profile["traces"])
-            if len(self._traces[run_id]) > self._keep_traces:
-                self._traces[run_id][0] = None
-
+            profile["stats"]["traces"] += 1
+            while len(profile["traces"]) > self._keep_traces:
+                evicted.append(profile["traces"].pop(0)["trace_id"])
+            self._touch(profile)
 
-class TracingServerHook(tf.train.SessionRunHook):
-    def __init__(self, source):
-        self._source = source
-
-    def begin(self):
-        super().begin()
-        self._source.running = True
-
-    def after_create_session(self, session, coord):
-        super().after_create_session(session, coord)
+        for evicted_id in evicted:
+            self._evict(run_id, evicted_id)
+        return runtime.total_seconds()
 
-    def before_run(self, run_context):
-        super().before_run(run_context)
-        self._source.before_run(run_context)
-        if self._source.is_tracing_on(run_context):
-            opts = (tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE))
-            return tf.train.SessionRunArgs(None, None, options=opts)
-        else:
-            return None
+    def _evict(self, run_id, trace_id):
+        self._trace_store.discard((run_id, trace_id))
+        for listener in self._eviction_listeners:
+            listener(run_id, trace_id)
 
-    def after_run(self, run_context, run_values):
-        super().after_run(run_context, run_values)
-        self._source.add_run(run_context, run_values)
+    def add_collected_trace(self, run_key, info, step, rank, runtime, data):
+        """
+        Adds a trace sent by a :class:`tftracer.collector.CollectorClient`. Traces of the same step of a run are
+        merged into one trace, with the devices of each worker prefixed by ``rank{rank}:``.
 
-    def end(self, session):
-        super().end(session)
-        self._source.running = False
+        Args:
+            run_key (str): identifies the run across the workers.
+            info (dict): fetches, feeds and options of the run.
+            step (int): the step of the run, preferably the global step.
+            rank (int): the worker that captured the trace.
+            runtime (float): the runtime of the step on the worker in seconds. The runtime of a step is that of its
+            slowest worker.
+            data (bytes): the serialized ``RunMetadata``.
+        """
+        from tensorflow import RunMetadata
+        run_metadata = RunMetadata.FromString(data)
+        for dev_stats in run_metadata.step_stats.dev_stats:
+            dev_stats.device = "rank{}:{}".format(rank, dev_stats.device)
+        key = ("collected", run_key)
+        now = datetime.datetime.now()
+
+        # Merging reads and rewrites the trace; serialize it across requests.
+        with self._collect_lock:
+            with self._lock:
+                profile = self._run_profile.get(key, None)
+                if profile is None:
+                    profile = self._new_profile(key, info, now)
+                steps = self._collected_steps.setdefault(key, OrderedDict())
+                if step < self._collected_floor.get(key, 0):
+                    # The step was already evicted.
+                    return
+                run_id = profile["run_id"]
+                if step in steps:
+                    trace_id = steps[step][0]
+                else:
+                    trace_id = profile["next_trace_id"]
+                    profile["next_trace_id"] += 1
+
+            # Counted per worker, before the trace is merged with those of the other workers.
+            self._add_op_stats(run_id, run_metadata)
+            previous = self._trace_store.get((run_id, trace_id)) if step in steps else None
+            if previous is not None:
+                # The stored trace may be being read by the web server; merge into a copy.
+                merged = RunMetadata()
+                merged.CopyFrom(previous)
+                merged.MergeFrom(run_metadata)
+                run_metadata = merged
+            self._trace_store.put((run_id, trace_id), run_metadata)
+            if self._session_log is not None:
+                self._session_log.submit(run_id, trace_id, run_metadata)
+
+            evicted = []
+            with self._lock:
+                stats = profile["stats"]
+                stats["last_run"] = now
+                if step in steps:
+                    step_runtime = steps[step][1]
+                    if runtime > step_runtime:
+                        steps[step] = (trace_id, runtime)
+                        stats["runtimes"] += datetime.timedelta(seconds=runtime - step_runtime) / stats["runs"]
+                else:
+                    steps[step] = (trace_id, runtime)
+                    stats["runtimes"] = (stats["runtimes"] * stats["runs"] + datetime.timedelta(seconds=runtime)) / \
+                        (stats["runs"] + 1)
+                    stats["runs"] += 1
+                    profile["traces"].append(
+                        {
+                            "trace_id": trace_id,
+                            "date": now
+                        }
+                    )
+                    stats["traces"] += 1
+                    while len(steps) > self._keep_traces:
+                        evicted_step, (evicted_id, _) = steps.popitem(last=False)
+                        self._collected_floor[key] = evicted_step + 1
+                        evicted.append(evicted_id)
+                    if evicted:
+                        profile["traces"] = [trace for trace in profile["traces"] if trace["trace_id"] not in evicted]
+                self._touch(profile)
+
+            for evicted_id in evicted:
+                self._evict(run_id, evicted_id)
+            if trace_id not in evicted:
+                # The trace changed; drop its cached renderings.
+                for listener in self._eviction_listeners:
+                    listener(run_id, trace_id)
 
 
 class TracingServer(VisualizationServer):
@@ -304,6 +876,9 @@ class TracingServer(VisualizationServer):
     users. By default, the web interface is accessible on `http://0.0.0.0:9999`.
     The web server stops at the end of the script. Use :func:`tftracer.TracingServer.join` to keep the server alive.
 
+    The server also merges the traces sent by the workers of a distributed job, see
+    :class:`tftracer.CollectorClient`.
+
     Example:
         Estimator API:
 
@@ -326,50 +901,111 @@ class TracingServer(VisualizationServer):
         server_ip (str): IP Address to which web server listens (default: "0.0.0.0")
         keep_traces (int): Number of traces per run which the tracing server should keep. \
         the server discards the oldest traces when exeeced the limit. (default: 5)
+        max_trace_bytes (int): Memory budget in bytes for the kept traces, measured by ``RunMetadata.ByteSize()``. \
+        Traces beyond the budget are spilled to the disk and read back when opened. None disables spilling. \
+        (default: 1 GiB)
+        trace_spill_dir (str): Directory for spilled traces. (default: a temporary directory)
+        trace_eviction_policy (str): Which traces to spill first: "oldest", "lru" or "largest". (default: "oldest")
+        render_cache_bytes (int): Memory budget in bytes for caching rendered timelines. (default: 256 MiB)
+        lod_min_events (int): Traces with at least this many ops are shown with levels of detail: zoomed out, short \
+        adjacent ops are merged and the ops of the visible range are loaded while zooming. None disables it. \
+        The ``lod`` query argument of a timeline overrides it. (default: 100000)
+        lod_cache_traces (int): Number of traces whose levels of detail are kept in memory. (default: 4)
+        single_canvas (bool): Draws all devices of a timeline into one figure instead of one figure per device. \
+        Timelines shown with levels of detail keep one figure per device. The ``single_canvas`` query argument of a \
+        timeline overrides it. (default: False)
+        partition_graphs (bool): Also records the partition graphs of traced steps, which makes the traces larger. \
+        (default: False)
+        The ``critical_path=1`` query argument of a timeline outlines its critical path and shows the slack of every \
+        op; the trace must include partition graphs, i.e. ``partition_graphs`` must be set or the RunMetadata \
+        added by hand must have been captured with ``output_partition_graphs=True``.
+        op_stats (bool): Keeps statistics of the op durations (count, mean, variance, p50 and p99) by op type and by \
+        node over all the traces of each run, served as the most expensive ops at ``/ops/<run_id>``, with the ``k``, \
+        ``by`` ("op" or "node") and ``sort`` ("total", "mean", "p99" or "count") query arguments. Traces are \
+        aggregated by a background thread. (default: True)
+        op_stats_queue_size (int): Number of traces waiting to be aggregated; traces beyond it are left out of the \
+        op statistics. (default: 16)
+        session_log (str): If set, every trace is appended to this session file by a background thread as soon as it \
+        is captured, so the session survives a crash of the job. (default: None)
+        session_log_queue_size (int): Number of traces waiting to be written to the session log. (default: 64)
+        session_log_overflow (str): What to do with new traces when the queue is full: "drop" them, or "defer" \
+        writing them until the writer catches up. (default: "drop")
+        session_log_runs_interval (float): Minimum number of seconds between two copies of the run profiles in the \
+        session log. (default: 10)
+        clock_offsets (dict or str): Clock offsets in microseconds, by host or device name, applied when showing \
+        traces combined from several hosts, e.g. by :class:`tftracer.CollectorClient`. "auto" estimates them from \
+        each trace. (default: None)
+        tracing_policy (tftracer.TracingPolicy): Traces steps automatically according to the policy, e.g. \
+        :class:`tftracer.EveryNStepsPolicy` or :class:`tftracer.AdaptivePolicy`. (default: None)
     """
 
     def __init__(self, **kwargs):
+        self._kwargs = kwargs
         self._source = TracingSource(**kwargs)
         super().__init__("tftracer", self._source, **kwargs)
         start_web_server_on_start = kwargs.get("start_web_server_on_start", True)
         if start_web_server_on_start:
             self.start_web_server()
-        self._hook = TracingServerHook(self._source)
+        self._hook = None
+
+    def enable_tracing(self, run_id, count=1, every=1):
+        """
+        Traces a burst of steps of a run, as the trace button of the web interface does for one step.
+        Traces of a burst are kept according to ``keep_traces`` and ``max_trace_bytes`` like any other trace.
+
+        Args:
+            run_id (int): the run as numbered in the web interface.
+            count (int): number of steps to trace. (default: 1)
+            every (int): trace one in every ``every`` steps of the run. (default: 1)
+        """
+        self._source.enable_tracing(run_id, count=count, every=every)
 
     def save_session(self, filename):
         """
-        Stores the tracing session to a pickle file.
+        Stores the tracing session to a session file. Each trace is compressed separately and the file is indexed,
+        so loading it later reads only the traces that are opened.
 
         Args:
             filename: path to the trace session file.
         """
         with open(filename, "wb") as fp:
-            pickle.dump(self._source, fp)
+            self._source.save(fp)
 
     def load_session(self, filename, gziped=None):
         """
-        Loads a tracing session into the current tracing server.
+        Loads a tracing session into the current tracing server. Both session files and the pickled sessions of
+        earlier versions are supported.
 
         Caution:
             This action discards the current data in the session.
 
         Args:
             filename: path to the trace session file.
-            gziped (bool): when set, determines if the trace file is gziped. when None, use gzip if the filename ends with ".gz";
+            gziped (bool): for pickled sessions, determines if the trace file is gziped. when None, use gzip if the
+            filename ends with ".gz";
         """
         running = self._source.running
         global_tracing = self._source.global_tracing
-        gziped = filename.endswith(".gz") if gziped is None else gziped
 
-        with open(filename, "rb") as fp:
-            if gziped:
-                data = gzip.decompress(fp.read())
-                self._source = pickle.loads(data)
-            else:
-                self._source = pickle.load(fp)
+        if is_session_file(filename):
+            kwargs = dict(self._kwargs)
+            kwargs.pop("session_log", None)
+            self._source = TracingSource.from_session_file(SessionFile(filename), **kwargs)
+        else:
+            gziped = filename.endswith(".gz") if gziped is None else gziped
+            with open(filename, "rb") as fp:
+                if gziped:
+                    data = gzip.decompress(fp.read())
+                    self._source = pickle.loads(data)
+                else:
+                    self._source = pickle.load(fp)
 
         self._source.running = running
         self._source.global_tracing = global_tracing
+        self._render_cache.clear()
+        with self._pyramids_lock:
+            self._pyramids.clear()
+        self._source.add_eviction_listener(self._invalidate_trace)
 
     @property
     def hook(self):
@@ -378,5 +1014,8 @@ class TracingServer(VisualizationServer):
         This object is meant to pass to tensorflow ``estimator`` API or ``MonitoredSession``.
 
         """
-
+        if self._hook is None:
+            from .tracing_hook import TracingServerHook
+            self._hook = TracingServerHook(self._source, self._kwargs.get("tracing_policy", None),
+                                           self._kwargs.get("partition_graphs", False))
         return self._hook